@@ -3,11 +3,18 @@ FastAPI service for proximal (location-based) recommendations.
 Exposes REST endpoints for getting personalized recommendations within a radius.
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Tuple, FrozenSet
+from dataclasses import dataclass, field
 from pathlib import Path
+from functools import lru_cache, partial
+from contextlib import contextmanager
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -15,13 +22,22 @@ from recommendation.proximal_recommendation import (
     build_proximal_recommendations,
     build_batch_proximal_recommendations,
     ProximalConfig,
-    get_location_coordinates
+    get_location_coordinates,
+    build_location_index,
+    build_taste_matrix,
+    LocationIndex,
+    TasteMatrix
 )
-from recommendation.tag_taxonomy import get_tags_dataframe
+from recommendation.tag_taxonomy import clear_tag_cache, get_tags_dataframe
 from recommendation.static_tagging import load_locations, load_reviews, build_location_tags
 from recommendation.user_profiles import ensure_user_actions, build_user_tag_affinities
 from config import PipelineConfig, PipelinePaths, ReviewTagConfig
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows; snapshot builds are then unlocked
+    fcntl = None
+
 
 # Pydantic models for request/response
 class ProximalRequest(BaseModel):
@@ -95,11 +111,23 @@ class HealthResponse(BaseModel):
     total_tags: int
 
 
+def _records_from_frame(recs: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a recommendations DataFrame into LocationRecommendation records (NaN -> None)."""
+    if recs.empty:
+        return []
+    
+    columns = [col for col in LocationRecommendation.model_fields if col in recs.columns]
+    records = recs[columns]
+    records = records.astype(object).where(records.notna(), None)
+    return records.to_dict(orient="records")
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Pinit Proximal Recommendations API",
     description="Location-based personalized restaurant recommendations",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -111,24 +139,193 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global data storage (loaded on startup)
-DATA_CACHE = {
-    "locations": None,
-    "tags": None,
-    "location_tags": None,
-    "user_tags": None,
-    "user_history": None,
-    "loaded": False
-}
-
 
-def load_data():
-    """Load all necessary data for recommendations."""
-    global DATA_CACHE
+@dataclass(slots=True, eq=False)
+class RecState:
+    """Recommendation data loaded on startup, attached to `app.state.rec`."""
+    locations: pd.DataFrame
+    locations_lat: np.ndarray
+    locations_lon: np.ndarray
+    location_index: LocationIndex
+    tags: pd.DataFrame
+    tag_id_to_name: Dict[Any, str]
+    place_lookup: Dict[str, int]
+    location_tags: pd.DataFrame
+    user_tags: pd.DataFrame
+    user_tags_indexed: pd.DataFrame
+    user_ids: List[str]
+    user_id_set: FrozenSet[str]
+    user_history: pd.DataFrame
+    taste_matrix: TasteMatrix
+    # Response cache bound to this state, so replacing the state drops its entries
+    records_cache: Callable[..., Tuple[Dict[str, Any], ...]] = field(init=False, repr=False)
     
-    if DATA_CACHE["loaded"]:
+    def __post_init__(self):
+        self.records_cache = lru_cache(maxsize=RESPONSE_CACHE_SIZE)(partial(_proximal_records, self))
+
+
+# Set once loading finishes; None while the service is starting up
+app.state.rec = None
+
+
+def get_state(request: Request) -> RecState:
+    """Dependency returning the loaded recommendation state."""
+    state = request.app.state.rec
+    if state is None:
+        raise HTTPException(status_code=503, detail="Data still loading, please try again")
+    return state
+
+
+# Response cache: centers are snapped to a ~100m grid so nearby requests share entries
+CACHE_COORD_DECIMALS = 3
+RESPONSE_CACHE_SIZE = 4096
+
+
+def _snap_coordinate(value: float) -> float:
+    return round(value, CACHE_COORD_DECIMALS)
+
+
+def _proximal_records(
+    state: RecState,
+    user_id: str,
+    lat: float,
+    lon: float,
+    radius_km: float,
+    max_results: int,
+    weights: Tuple[float, float, float]
+) -> Tuple[Dict[str, Any], ...]:
+    """Recommendation records for a snapped center point (cached via `RecState.records_cache`)."""
+    taste_weight, proximity_weight, quality_weight = weights
+    config = ProximalConfig(
+        radius_km=radius_km,
+        max_results=max_results,
+        taste_weight=taste_weight,
+        proximity_weight=proximity_weight,
+        quality_weight=quality_weight
+    )
+    recs = build_proximal_recommendations(
+        user_id,
+        lat,
+        lon,
+        state.locations,
+        state.user_tags,
+        state.location_tags,
+        config,
+        state.locations_lat,
+        state.locations_lon,
+        state.taste_matrix,
+        state.location_index
+    )
+    return tuple(_records_from_frame(recs))
+
+
+# Tables snapshotted to Parquet after a full build, so restarts skip the CSV pipeline
+SNAPSHOT_TABLES = ["locations", "tags", "location_tags", "user_tags", "user_history"]
+CATEGORY_COLUMNS = {"locations": ["cuisine_primary", "price_bucket"]}
+
+
+def _source_files(paths: PipelinePaths) -> List[Path]:
+    candidates = [
+        paths.details_csv(),
+        paths.reviews_csv(),
+        paths.base_csv(),
+        paths.user_actions_csv,
+        paths.data_dir / "user_location_actions.csv",
+    ]
+    return [path for path in candidates if path and path.exists()]
+
+
+def _snapshot_path(snapshot_dir: Path, name: str) -> Path:
+    return snapshot_dir / f"{name}.parquet"
+
+
+def _snapshot_is_fresh(paths: PipelinePaths, snapshot_dir: Path) -> bool:
+    """True when every snapshot file exists and is newer than all source CSVs."""
+    snapshot_files = [_snapshot_path(snapshot_dir, name) for name in SNAPSHOT_TABLES]
+    if not all(path.exists() for path in snapshot_files):
+        return False
+    sources = _source_files(paths)
+    if not sources:
+        return False
+    newest_source = max(path.stat().st_mtime for path in sources)
+    return min(path.stat().st_mtime for path in snapshot_files) > newest_source
+
+
+@contextmanager
+def _snapshot_lock(snapshot_dir: Path):
+    """Hold an exclusive lock on the snapshot directory across worker processes."""
+    if fcntl is None:
+        yield
         return
+    with open(snapshot_dir / ".snapshot.lock", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _read_snapshot(snapshot_dir: Path) -> Optional[Dict[str, pd.DataFrame]]:
+    """Read every snapshot table, or None if any of them cannot be read."""
+    try:
+        return {name: pd.read_parquet(_snapshot_path(snapshot_dir, name)) for name in SNAPSHOT_TABLES}
+    except Exception as e:
+        print(f"⚠ Could not read Parquet snapshot, rebuilding: {type(e).__name__}: {e}")
+        return None
+
+
+def _write_snapshot(tables: Dict[str, pd.DataFrame], snapshot_dir: Path):
+    # Write every table to a private temp file, then move them into place, so
+    # a reader never sees a partially written file
+    tmp_paths = {
+        name: snapshot_dir / f"{name}.parquet.{os.getpid()}.tmp" for name in SNAPSHOT_TABLES
+    }
+    try:
+        for name in SNAPSHOT_TABLES:
+            tables[name].to_parquet(tmp_paths[name], compression="zstd", index=False)
+        for name in SNAPSHOT_TABLES:
+            os.replace(tmp_paths[name], _snapshot_path(snapshot_dir, name))
+    except Exception as e:
+        # The snapshot is only a startup cache; never fail the load because of it
+        print(f"⚠ Could not write Parquet snapshot: {type(e).__name__}: {e}")
+        for path in tmp_paths.values():
+            path.unlink(missing_ok=True)
+
+
+def _build_tables(paths: PipelinePaths, config: PipelineConfig) -> Dict[str, pd.DataFrame]:
+    """Run the CSV pipeline and return the tables that make up the snapshot."""
+    tags_df = get_tags_dataframe()
+    locations = load_locations(paths)
+    place_lookup = dict(zip(
+        locations["google_place_id"].tolist(),
+        locations["location_id"].tolist(),
+    ))
+    reviews = load_reviews(paths, place_lookup)
+    location_tags = build_location_tags(locations, reviews, config.review_tagging)
+    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
+    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
     
+    tables = {
+        "locations": locations,
+        "tags": tags_df,
+        "location_tags": location_tags,
+        "user_tags": user_tags,
+        "user_history": user_history,
+    }
+    for name, columns in CATEGORY_COLUMNS.items():
+        for col in columns:
+            if col in tables[name].columns:
+                tables[name][col] = tables[name][col].astype("category")
+    return tables
+
+
+def load_data(rebuild: bool = False) -> RecState:
+    """
+    Load all necessary data for recommendations.
+    
+    Uses the Parquet snapshot when it is newer than the source CSVs, unless
+    `rebuild` is set.
+    """
     print("Loading recommendation data...")
     
     # Configuration
@@ -141,33 +338,60 @@ def load_data():
     review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
     config = PipelineConfig(paths=paths, review_tagging=review_cfg, synthetic_users=True)
     
-    # Load data
-    tags_df = get_tags_dataframe()
-    locations = load_locations(paths)
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
-    reviews = load_reviews(paths, place_lookup)
-    location_tags = build_location_tags(locations, reviews, config.review_tagging)
-    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
-    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
+    # Load data. Workers starting together take turns here, so only the first
+    # rebuilds a stale snapshot and the rest read the one it wrote.
+    with _snapshot_lock(OUTPUT_DIR):
+        tables = None
+        if not rebuild and _snapshot_is_fresh(paths, OUTPUT_DIR):
+            print(f"Reading Parquet snapshot from {OUTPUT_DIR}")
+            tables = _read_snapshot(OUTPUT_DIR)
+        if tables is None:
+            tables = _build_tables(paths, config)
+            _write_snapshot(tables, OUTPUT_DIR)
+    
+    locations = tables["locations"]
+    tags_df = tables["tags"]
+    location_tags = tables["location_tags"]
+    user_tags = tables["user_tags"]
+    user_history = tables["user_history"]
+    place_lookup = dict(zip(
+        locations["google_place_id"].tolist(),
+        locations["location_id"].tolist(),
+    ))
     
-    # Cache data
-    DATA_CACHE["locations"] = locations
-    DATA_CACHE["tags"] = tags_df
-    DATA_CACHE["location_tags"] = location_tags
-    DATA_CACHE["user_tags"] = user_tags
-    DATA_CACHE["user_history"] = user_history
-    DATA_CACHE["loaded"] = True
+    location_index = build_location_index(locations, dtype=np.float32)
+    user_ids = user_tags["user_id"].unique().tolist()
+    
+    state = RecState(
+        locations=locations,
+        locations_lat=location_index.lats,
+        locations_lon=location_index.lons,
+        location_index=location_index,
+        tags=tags_df,
+        tag_id_to_name=dict(zip(tags_df["tag_id"].tolist(), tags_df["text"].tolist())),
+        place_lookup=place_lookup,
+        location_tags=location_tags,
+        user_tags=user_tags,
+        user_tags_indexed=user_tags.set_index("user_id", drop=False).sort_index(),
+        user_ids=user_ids,
+        user_id_set=frozenset(user_ids),
+        user_history=user_history,
+        taste_matrix=build_taste_matrix(user_tags, location_tags)
+    )
     
     print(f"✓ Loaded {len(locations):,} locations")
     print(f"✓ Loaded {len(tags_df)} tags")
     print(f"✓ Loaded {len(user_tags):,} user-tag affinities")
     print(f"✓ Data ready for API requests")
+    
+    return state
 
 
 @app.on_event("startup")
 async def startup_event():
     """Load data when API starts."""
-    load_data()
+    if app.state.rec is None:
+        app.state.rec = await run_in_threadpool(load_data)
 
 
 @app.get("/", response_model=Dict[str, str])
@@ -181,20 +405,22 @@ async def root():
 
 
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(request: Request):
     """Health check endpoint."""
+    state: Optional[RecState] = request.app.state.rec
+    loaded = state is not None
     return HealthResponse(
-        status="healthy" if DATA_CACHE["loaded"] else "loading",
+        status="healthy" if loaded else "loading",
         timestamp=datetime.utcnow().isoformat(),
-        data_loaded=DATA_CACHE["loaded"],
-        total_locations=len(DATA_CACHE["locations"]) if DATA_CACHE["loaded"] else 0,
-        total_users=DATA_CACHE["user_tags"]["user_id"].nunique() if DATA_CACHE["loaded"] else 0,
-        total_tags=len(DATA_CACHE["tags"]) if DATA_CACHE["loaded"] else 0
+        data_loaded=loaded,
+        total_locations=len(state.locations) if loaded else 0,
+        total_users=len(state.user_id_set) if loaded else 0,
+        total_tags=len(state.tags) if loaded else 0
     )
 
 
 @app.post("/recommendations/proximal", response_model=ProximalResponse)
-async def get_proximal_recommendations(request: ProximalRequest):
+async def get_proximal_recommendations(request: ProximalRequest, state: RecState = Depends(get_state)):
     """
     Get personalized location recommendations within a radius.
     
@@ -203,65 +429,26 @@ async def get_proximal_recommendations(request: ProximalRequest):
     - Proximity to center point
     - Location quality (ratings)
     """
-    if not DATA_CACHE["loaded"]:
-        raise HTTPException(status_code=503, detail="Data still loading, please try again")
-    
     # Validate user exists
-    if request.user_id not in DATA_CACHE["user_tags"]["user_id"].values:
+    if request.user_id not in state.user_id_set:
         raise HTTPException(
             status_code=404,
-            detail=f"User '{request.user_id}' not found. Available users: {DATA_CACHE['user_tags']['user_id'].unique().tolist()[:5]}"
+            detail=f"User '{request.user_id}' not found. Available users: {state.user_ids[:5]}"
         )
     
-    # Create config
-    config = ProximalConfig(
-        radius_km=request.radius_km,
-        max_results=request.max_results,
-        taste_weight=request.taste_weight,
-        proximity_weight=request.proximity_weight,
-        quality_weight=request.quality_weight
-    )
-    
-    # Generate recommendations
-    recs = build_proximal_recommendations(
+    # Generate recommendations (cached per snapped center; CPU-bound work runs off the event loop)
+    records = await run_in_threadpool(
+        state.records_cache,
         request.user_id,
-        request.latitude,
-        request.longitude,
-        DATA_CACHE["locations"],
-        DATA_CACHE["user_tags"],
-        DATA_CACHE["location_tags"],
-        config
+        _snap_coordinate(request.latitude),
+        _snap_coordinate(request.longitude),
+        request.radius_km,
+        request.max_results,
+        (request.taste_weight, request.proximity_weight, request.quality_weight)
     )
     
-    if recs.empty:
-        return ProximalResponse(
-            user_id=request.user_id,
-            center_lat=request.latitude,
-            center_lon=request.longitude,
-            radius_km=request.radius_km,
-            total_results=0,
-            recommendations=[],
-            timestamp=datetime.utcnow().isoformat()
-        )
-    
     # Convert to response model
-    recommendations = []
-    for _, row in recs.iterrows():
-        recommendations.append(LocationRecommendation(
-            location_id=int(row["location_id"]),
-            name=row["name"],
-            vicinity=row.get("vicinity"),
-            cuisine_primary=row.get("cuisine_primary"),
-            rating=float(row["rating"]) if pd.notna(row.get("rating")) else None,
-            user_ratings_total=int(row["user_ratings_total"]) if pd.notna(row.get("user_ratings_total")) else None,
-            price_level=float(row["price_level"]) if pd.notna(row.get("price_level")) else None,
-            distance_km=float(row["distance_km"]),
-            taste_score=float(row["taste_score"]),
-            proximity_score=float(row["proximity_score"]),
-            quality_score=float(row["quality_score"]),
-            final_score=float(row["final_score"]),
-            rank=int(row["rank"])
-        ))
+    recommendations = [LocationRecommendation(**rec) for rec in records]
     
     return ProximalResponse(
         user_id=request.user_id,
@@ -275,15 +462,12 @@ async def get_proximal_recommendations(request: ProximalRequest):
 
 
 @app.post("/recommendations/proximal/batch", response_model=BatchProximalResponse)
-async def get_batch_proximal_recommendations(request: BatchProximalRequest):
+async def get_batch_proximal_recommendations(request: BatchProximalRequest, state: RecState = Depends(get_state)):
     """
     Get proximal recommendations for multiple users at once.
     """
-    if not DATA_CACHE["loaded"]:
-        raise HTTPException(status_code=503, detail="Data still loading, please try again")
-    
     # Validate users exist
-    available_users = set(DATA_CACHE["user_tags"]["user_id"].unique())
+    available_users = state.user_id_set
     invalid_users = [uid for uid in request.user_ids if uid not in available_users]
     
     if invalid_users:
@@ -298,39 +482,29 @@ async def get_batch_proximal_recommendations(request: BatchProximalRequest):
         max_results=request.max_results
     )
     
-    # Generate batch recommendations
-    batch_recs = build_batch_proximal_recommendations(
+    # Generate batch recommendations (CPU-bound, keep it off the event loop)
+    batch_recs = await run_in_threadpool(
+        build_batch_proximal_recommendations,
         request.user_ids,
         request.latitude,
         request.longitude,
-        DATA_CACHE["locations"],
-        DATA_CACHE["user_tags"],
-        DATA_CACHE["location_tags"],
-        config
+        state.locations,
+        state.user_tags,
+        state.location_tags,
+        config,
+        state.locations_lat,
+        state.locations_lon,
+        state.taste_matrix,
+        state.location_index
     )
     
-    # Group by user
+    # Group by user (split once instead of filtering per user)
+    recs_by_user = dict(tuple(batch_recs.groupby("user_id", sort=False)))
     results = []
     for user_id in request.user_ids:
-        user_recs = batch_recs[batch_recs["user_id"] == user_id]
+        user_recs = recs_by_user.get(user_id, batch_recs.iloc[0:0])
         
-        recommendations = []
-        for _, row in user_recs.iterrows():
-            recommendations.append(LocationRecommendation(
-                location_id=int(row["location_id"]),
-                name=row["name"],
-                vicinity=row.get("vicinity"),
-                cuisine_primary=row.get("cuisine_primary"),
-                rating=float(row["rating"]) if pd.notna(row.get("rating")) else None,
-                user_ratings_total=int(row["user_ratings_total"]) if pd.notna(row.get("user_ratings_total")) else None,
-                price_level=float(row["price_level"]) if pd.notna(row.get("price_level")) else None,
-                distance_km=float(row["distance_km"]),
-                taste_score=float(row["taste_score"]),
-                proximity_score=float(row["proximity_score"]),
-                quality_score=float(row["quality_score"]),
-                final_score=float(row["final_score"]),
-                rank=int(row["rank"])
-            ))
+        recommendations = [LocationRecommendation(**rec) for rec in _records_from_frame(user_recs)]
         
         results.append(ProximalResponse(
             user_id=user_id,
@@ -353,15 +527,32 @@ async def get_batch_proximal_recommendations(request: BatchProximalRequest):
     )
 
 
+@app.post("/admin/reload", response_model=Dict[str, Any])
+async def reload_data(request: Request):
+    """
+    Rebuild recommendation data from the source files and flush the cached responses.
+    
+    The current state keeps serving requests until the new one is swapped in.
+    Each state carries its own response cache, so in-flight requests on the
+    old state cannot leave entries behind for the new one.
+    """
+    clear_tag_cache()
+    state = await run_in_threadpool(load_data, True)
+    request.app.state.rec = state
+    
+    return {
+        "reloaded": True,
+        "total_locations": len(state.locations),
+        "total_users": len(state.user_id_set)
+    }
+
+
 @app.get("/locations/{location_id}/coordinates", response_model=LocationCoordinatesResponse)
-async def get_coordinates(location_id: int):
+async def get_coordinates(location_id: int, state: RecState = Depends(get_state)):
     """
     Get coordinates for a specific location.
     """
-    if not DATA_CACHE["loaded"]:
-        raise HTTPException(status_code=503, detail="Data still loading, please try again")
-    
-    coords = get_location_coordinates(location_id, DATA_CACHE["locations"])
+    coords = get_location_coordinates(location_id, state.locations, state.location_index)
     
     if coords is None:
         return LocationCoordinatesResponse(
@@ -381,38 +572,35 @@ async def get_coordinates(location_id: int):
 
 
 @app.get("/users", response_model=Dict[str, Any])
-async def list_users(limit: int = Query(10, ge=1, le=100)):
+async def list_users(limit: int = Query(10, ge=1, le=100), state: RecState = Depends(get_state)):
     """
     List available users in the system.
     """
-    if not DATA_CACHE["loaded"]:
-        raise HTTPException(status_code=503, detail="Data still loading, please try again")
-    
-    users = DATA_CACHE["user_tags"]["user_id"].unique().tolist()[:limit]
+    users = state.user_ids[:limit]
     
     return {
-        "total_users": DATA_CACHE["user_tags"]["user_id"].nunique(),
+        "total_users": len(state.user_id_set),
         "users": users,
         "limit": limit
     }
 
 
 @app.get("/users/{user_id}/profile", response_model=Dict[str, Any])
-async def get_user_profile(user_id: str, top_n: int = Query(10, ge=1, le=50)):
+def get_user_profile(
+    user_id: str,
+    top_n: int = Query(10, ge=1, le=50),
+    state: RecState = Depends(get_state)
+):
     """
     Get a user's taste profile (top tag preferences).
     """
-    if not DATA_CACHE["loaded"]:
-        raise HTTPException(status_code=503, detail="Data still loading, please try again")
-    
-    user_profile = DATA_CACHE["user_tags"][DATA_CACHE["user_tags"]["user_id"] == user_id]
-    
-    if user_profile.empty:
+    if user_id not in state.user_id_set:
         raise HTTPException(status_code=404, detail=f"User '{user_id}' not found")
     
+    user_profile = state.user_tags_indexed.loc[[user_id]]
     user_profile = user_profile.nlargest(top_n, "score")
     
-    tag_names = DATA_CACHE["tags"].set_index("tag_id")["text"].to_dict()
+    tag_names = state.tag_id_to_name
     
     preferences = []
     for _, row in user_profile.iterrows():
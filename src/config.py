@@ -70,3 +70,4 @@ class PipelineConfig:
     )
     synthetic_users: bool = True
     top_k_per_user: int = 30
+    save_format: str = "parquet"  # "parquet" (zstd) or "csv"
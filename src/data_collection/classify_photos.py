@@ -1,7 +1,15 @@
 import os
+import argparse
 import base64
+import json
+import re
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from supabase import create_client, Client
 from openai import OpenAI
 from dotenv import load_dotenv
@@ -16,32 +24,67 @@ OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Shared keep-alive connection pool for the Google Places calls (sized for the
+# worker pool), with retries on rate limiting and transient server errors.
+HTTP_POOL_SIZE = 32
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+PLACES_HEADERS = {
+    "Content-type" : "application/json",
+    "X-Goog-Api-Key": GOOGLE_API_KEY,
+    "X-Goog-FieldMask": "id,displayName,photos"
+}
+
+# Each classification attempt is recorded in locations.photo_classification_status
+# and photo_classification_attempts; a place stops being picked up once it is
+# scored, once Google reports no photo, or after this many attempts without a score
+MAX_CLASSIFY_ATTEMPTS = 3
+STATUS_SCORED = "scored"
+STATUS_NO_PHOTO = "no_photo"
+STATUS_UNPARSEABLE = "unparseable"
+STATUS_OUT_OF_RANGE = "out_of_range"
+
 
 # ---------------------------------------------------------
-# Step 1 — Fetch google_place_id values from Supabase
+# Step 1 — Fetch unclassified google_place_id values from Supabase
 # ---------------------------------------------------------
-def get_all_google_place_ids():
-    """Fetch all place IDs from locations table"""
-    data = supabase.table("locations").select("google_place_id").execute()
+def get_unclassified_place_ids() -> dict:
+    """
+    Fetch places without a photo classification, as {place_id: attempts so far}.
+
+    A place is retried until it has a photo_reference_score, except that places
+    with no photo (attempts set to MAX_CLASSIFY_ATTEMPTS) and places whose answers
+    could not be used MAX_CLASSIFY_ATTEMPTS times are left alone. Transient
+    failures (Places, download or OpenAI request errors) record nothing, so
+    they are retried on the next run without using up an attempt.
+    """
+    data = (supabase.table("locations")
+            .select("google_place_id,photo_classification_attempts")
+            .is_("photo_reference_score", "null")
+            .or_(f"photo_classification_attempts.is.null,"
+                 f"photo_classification_attempts.lt.{MAX_CLASSIFY_ATTEMPTS}")
+            .execute())
     rows = data.data
-    return [row["google_place_id"] for row in rows]
+    return {row["google_place_id"]: row["photo_classification_attempts"] or 0 for row in rows}
 
 
 # ---------------------------------------------------------
 # Step 2 — Fetch top photo reference for a Place ID
 # ---------------------------------------------------------
 def get_photo_reference(place_id: str):
-    """Get the first photo resource name from Google Places API v1"""
+    """
+    Get the first photo resource name from Google Places API v1.
+    Returns None if the place has no photos; request errors are raised.
+    """
     url = f"https://places.googleapis.com/v1/places/{place_id}"
 
-    headers = {
-        "Content-type" : "application/json",
-        "X-Goog-Api-Key": GOOGLE_API_KEY,
-        "X-Goog-FieldMask": "id,displayName,photos"
-    }
-
     try:
-        res = requests.get(url, headers=headers, timeout=10).json()
+        res = session.get(url, headers=PLACES_HEADERS, timeout=10).json()
         photos = res.get("photos", [])
 
         if not photos:
@@ -54,7 +97,7 @@ def get_photo_reference(place_id: str):
 
     except Exception as e:
         print(f"Error fetching photo reference for {place_id}: {e}")
-        return None
+        raise
 
 
 # ---------------------------------------------------------
@@ -67,7 +110,7 @@ def download_photo(photo_reference: str) -> bytes:
     
 
     try:
-        response = requests.get(url, timeout=10)
+        response = session.get(url, timeout=10)
         response.raise_for_status()
         return response.content  # raw JPEG bytes
     except Exception as e:
@@ -77,29 +120,11 @@ def download_photo(photo_reference: str) -> bytes:
 # ---------------------------------------------------------
 # Step 4 — Send image to OpenAI vision model
 # ---------------------------------------------------------
-def classify_image_with_openai(image_bytes: bytes):
-    """
-    Send image to OpenAI vision model for classification.
-    Returns a dict with classification results.
-    """
-    base64_img = base64.b64encode(image_bytes).decode("utf-8")
+CLASSIFIER_MODEL = "gpt-4.1-mini"
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",  # Fixed: use correct model name
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",  # Fixed: correct type
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_img}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": """# Role and Objective
+# Static scoring rubric. Sent as the system message so it is identical across
+# requests and eligible for OpenAI prompt caching.
+SCORING_PROMPT = """# Role and Objective
 
 You are a restaurant photo quality classifier. Your task is to evaluate a single restaurant photo and assign a quality score from 1-3 based on photographic professionalism. This score will be used to prioritize restaurants with high-quality cover photos in a recommendation system.
 
@@ -144,17 +169,6 @@ Remember: You are filtering out clearly bad photos, not being a strict photograp
 - **Reserve score of 1** for clearly amateur photos with multiple significant issues (very blurry, terrible lighting, awkward angles, obvious smartphone snapshot quality)
 
 
-# Reasoning Process
-
-Before assigning your score, think step-by-step:
-
-1. **Initial Assessment**: What is your first impression - does this look professional or amateur?
-2. **Clarity Check**: Evaluate the resolution and sharpness
-3. **Composition Analysis**: Assess the angle, framing, and completeness
-4. **Lighting Evaluation**: Judge the lighting quality and balance
-5. **Photography Style**: Determine if this appears professionally shot or like a casual smartphone photo
-6. **Final Determination**: Based on the above, how many criteria pass professional standards?
-
 ## Irrelevant attributes
 The following is irrelevant
 - The **subject of the photo** (food, interior, exterior, ambiance - all are acceptable if professionally photographed)
@@ -168,8 +182,7 @@ The following is irrelevant
 
 # Output Format
 
-Provide your response as exactly a single number of either 1,2,3:
-e.g.
+Respond with only the score line, with no reasoning or other text before or after it:
 ```
 Score: 1
 ```
@@ -194,25 +207,63 @@ Score: 1
 Score: 2
 ```
 """
+
+
+def build_classification_request(image_bytes: bytes) -> dict:
+    """Chat-completions request body for classifying one image."""
+    base64_img = base64.b64encode(image_bytes).decode("utf-8")
+
+    return {
+        "model": CLASSIFIER_MODEL,
+        "messages": [
+            {"role": "system", "content": SCORING_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_img}",
+                            # Fixed low-res token charge instead of tile-based pricing
+                            "detail": "low"
                         }
-                    ]
-                },
-            ],
-            max_tokens=500
-        )
-
-        result_text = response.choices[0].message.content
-        # Parse the score from the response
-        # Expected format: "Score: [1, 2, 3]" or "Score: 2"
-        import re
-        score_match = re.search(r'Score:\s*(\d)', result_text)
-
-        if score_match:
-            score = int(score_match.group(1))
-            return score
-        else:
-            # If no score found, return the raw text
-            return None
+                    }
+                ]
+            },
+        ],
+        # The expected answer is just "Score: <digit>"
+        "max_tokens": 10,
+    }
+
+
+# Expected format: "Score: [1, 2, 3]" or "Score: 2"
+SCORE_RE = re.compile(r'Score:\s*(\d)')
+VALID_SCORES = (1, 2, 3)
+
+
+def parse_score(result_text: str):
+    """Parse the score from the model output, or None if no score is found."""
+    score_match = SCORE_RE.search(result_text or "")
+
+    if score_match:
+        return int(score_match.group(1))
+    return None
+
+
+def classify_image_with_openai(image_bytes: bytes):
+    """
+    Send image to OpenAI vision model for classification.
+    Returns the score (None if it can't be parsed), or an error dict if the
+    request failed or the reply was cut off by max_tokens.
+    """
+    try:
+        response = client.chat.completions.create(**build_classification_request(image_bytes))
+
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            print("Error classifying image with OpenAI: reply truncated by max_tokens")
+            return {"error": "truncated"}
+        return parse_score(choice.message.content)
 
     except Exception as e:
         print(f"Error classifying image with OpenAI: {e}")
@@ -225,21 +276,14 @@ Score: 2
 def update_location_with_classification(place_id: str, to_update: dict):
     """Update the locations table with photo classification results"""
     try:
-        # Debug: Check if the record exists first
-        check = supabase.table("locations").select("google_place_id, location_id").eq("google_place_id", place_id).execute()
-
-        if not check.data:
-            print(f"✗ Record not found for google_place_id: {place_id}")
-            return False
-
-        # Perform update
+        # An empty result means no row matched the place id
         result = supabase.table("locations").update(to_update).eq("google_place_id", place_id).execute()
 
         if result.data:
             print(f"✓ Updated {place_id} with classification")
             return True
         else:
-            print(f"✗ No rows updated for {place_id}")
+            print(f"✗ No rows updated for {place_id} (record not found?)")
             print(f"  Attempted update: {to_update}")
             return False
     except Exception as e:
@@ -250,71 +294,292 @@ def update_location_with_classification(place_id: str, to_update: dict):
         return False
 
 
+def classification_update(place_id: str, photo_ref: str, score, attempts: int) -> dict:
+    """Row update recording one classification attempt and its score (if usable)."""
+    if score is None:
+        status = STATUS_UNPARSEABLE
+    elif score not in VALID_SCORES:
+        # Kept out of photo_reference_score so the place is retried
+        print(f"⚠ Out-of-range score {score} for {place_id}")
+        status, score = STATUS_OUT_OF_RANGE, None
+    else:
+        status = STATUS_SCORED
+    return {
+        'photo_reference': photo_ref,
+        'photo_reference_score': score,
+        'photo_classification_status': status,
+        'photo_classification_attempts': attempts + 1,
+    }
+
+
+NO_PHOTO_UPDATE = {
+    'photo_classification_status': STATUS_NO_PHOTO,
+    'photo_classification_attempts': MAX_CLASSIFY_ATTEMPTS,
+}
+
+
 # ---------------------------------------------------------
-# Main pipeline
+# Concurrency helpers
 # ---------------------------------------------------------
-def main():
+MAX_WORKERS = 12
+MAX_PLACES_PER_SECOND = 4.0  # Adjust based on your API rate limits
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart."""
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiter = RateLimiter(MAX_PLACES_PER_SECOND)
+
+
+def process_one(place_id: str, attempts: int = 0) -> str:
     """
-    Main pipeline:
-    1. Fetch all place IDs from database
-    2. For each place, get photo reference and download image
-    3. Classify image with OpenAI vision model
-    4. Save classification results to database
+    Fetch, classify and store the photo for a single place.
+    Returns one of "processed", "skipped" or "error".
     """
-    place_ids = get_all_google_place_ids()
-    place_ids = place_ids[253:]
-    total = len(place_ids)
+    rate_limiter.wait()
 
-    print(f"Processing {total} locations...")
+    # Always fetch photo reference from API v1
+    print(f"  ↳ [{place_id}] Fetching photo reference...")
+    photo_ref = get_photo_reference(place_id)
 
-    processed = 0
-    skipped = 0
-    errors = 0
+    if not photo_ref:
+        print(f"  ↳ [{place_id}] No photo found")
+        update_location_with_classification(place_id, NO_PHOTO_UPDATE)
+        return "skipped"
 
-    for idx, place_id in enumerate(place_ids, 1):
-        print(f"\n[{idx}/{total}] Processing {place_id}...")
+    # Download image
+    print(f"  ↳ [{place_id}] Downloading photo...")
+    image_bytes = download_photo(photo_ref)
 
-        # Always fetch photo reference from API v1
-        print(f"  ↳ Fetching photo reference...")
-        photo_ref = get_photo_reference(place_id)
+    if not image_bytes:
+        print(f"  ↳ [{place_id}] Failed to download photo")
+        return "error"
 
-        if not photo_ref:
-            print(f"  ↳ No photo found")
-            skipped += 1
-            continue
+    # Classify with OpenAI
+    print(f"  ↳ [{place_id}] Classifying with OpenAI...")
+    classification = classify_image_with_openai(image_bytes)
+    if isinstance(classification, dict):
+        # Request failed; record nothing so the place is retried
+        return "error"
+    toUpdate = classification_update(place_id, photo_ref, classification, attempts)
+    print(toUpdate, 'with a id', place_id)
+    # Update database
+    success = update_location_with_classification(place_id, toUpdate)
+
+    return "processed" if success else "error"
 
-        # Download image
-        print(f"  ↳ Downloading photo...")
-        image_bytes = download_photo(photo_ref)
 
-        if not image_bytes:
-            print(f"  ↳ Failed to download photo")
-            errors += 1
+# ---------------------------------------------------------
+# Batch mode — classify through the OpenAI Batch API
+# ---------------------------------------------------------
+BATCH_DIR = Path("output/photo_batches")
+BATCH_MAX_REQUESTS = 2000  # keeps each JSONL upload well under the 200MB limit
+BATCH_POLL_SECONDS = 60
+
+
+def fetch_photo(place_id: str):
+    """
+    Return (photo_reference, image_bytes) for a place, (None, None) if it has
+    no photo, or None if the photo could not be fetched.
+    """
+    rate_limiter.wait()
+
+    photo_ref = get_photo_reference(place_id)
+    if not photo_ref:
+        return None, None
+
+    image_bytes = download_photo(photo_ref)
+    if not image_bytes:
+        return None
+
+    return photo_ref, image_bytes
+
+
+def write_batch_files(place_ids: list) -> tuple:
+    """
+    Fetch photos concurrently and write them as Batch API JSONL request files.
+    Returns (list of JSONL paths, {place_id: photo_reference}, place ids with no
+    photo, count of places whose photo could not be fetched).
+    """
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    run_tag = time.strftime("%Y%m%d_%H%M%S")
+
+    paths = []
+    photo_refs = {}
+    no_photo = []
+    failed = 0
+    handle = None
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(fetch_photo, place_id): place_id for place_id in place_ids}
+        for future in as_completed(futures):
+            place_id = futures[future]
+            try:
+                photo = future.result()
+            except Exception as e:
+                print(f"✗ Unexpected error for {place_id}: {type(e).__name__}: {e}")
+                photo = None
+            if photo is None:
+                failed += 1
+                continue
+            if photo[0] is None:
+                no_photo.append(place_id)
+                continue
+
+            if len(photo_refs) % BATCH_MAX_REQUESTS == 0:
+                if handle:
+                    handle.close()
+                paths.append(BATCH_DIR / f"photo_requests_{run_tag}_{len(paths):03d}.jsonl")
+                handle = paths[-1].open("w")
+
+            photo_ref, image_bytes = photo
+            photo_refs[place_id] = photo_ref
+            handle.write(json.dumps({
+                "custom_id": place_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_classification_request(image_bytes),
+            }) + "\n")
+
+    if handle:
+        handle.close()
+
+    return paths, photo_refs, no_photo, failed
+
+
+def run_classification_batch(path: Path) -> dict:
+    """Upload one JSONL file, wait for the batch to finish and return {place_id: score}."""
+    with path.open("rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"  ↳ Submitted batch {batch.id} ({path.name})")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        print(f"  ↳ Batch {batch.id}: {batch.status}")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"✗ Batch {batch.id} ended with status {batch.status}")
+        return {}
+
+    scores = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
             continue
+        choice = response.get("body", {})["choices"][0]
+        if choice.get("finish_reason") == "length":
+            # Truncated reply; leave the place unrecorded so it is retried
+            continue
+        scores[result["custom_id"]] = parse_score(choice["message"]["content"])
+    return scores
 
-        # Classify with OpenAI
-        print(f"  ↳ Classifying with OpenAI...")
-        classification = classify_image_with_openai(image_bytes)
-        toUpdate = {'photo_reference': photo_ref, 'photo_reference_score':classification}
-        print(toUpdate, 'with a id', place_id)
-        # Update database
-        success = update_location_with_classification(place_id, toUpdate)
 
-        if success:
-            processed += 1
-        else:
-            errors += 1
+def main_batch(place_ids: dict) -> dict:
+    """
+    Batch pipeline: fetch photos concurrently, classify them with the Batch API
+    (50% cheaper, 24h turnaround) and write the scores back to Supabase.
+    """
+    print(f"  ↳ Fetching photos for {len(place_ids)} locations...")
+    paths, photo_refs, no_photo, failed = write_batch_files(place_ids)
 
-        # Rate limiting: sleep to avoid hitting API limits
-        time.sleep(1)  # Adjust based on your API rate limits
+    for place_id in no_photo:
+        update_location_with_classification(place_id, NO_PHOTO_UPDATE)
+
+    processed = 0
+    for path in paths:
+        scores = run_classification_batch(path)
+        for place_id, score in scores.items():
+            to_update = classification_update(place_id, photo_refs[place_id], score, place_ids[place_id])
+            if update_location_with_classification(place_id, to_update):
+                processed += 1
+
+    # Anything not fetched, or fetched but not stored (failed request or update), is an error
+    return {"processed": processed, "skipped": len(no_photo), "error": failed + len(photo_refs) - processed}
+
+
+# ---------------------------------------------------------
+# Main pipeline
+# ---------------------------------------------------------
+def main(use_batch: bool = False):
+    """
+    Main pipeline:
+    1. Fetch place IDs that haven't been classified yet
+    2. For each place, get photo reference and download image
+    3. Classify image with OpenAI vision model
+    4. Save classification results to database
+
+    Places are processed concurrently by a bounded thread pool; the shared
+    rate limiter keeps the overall request rate under the API limits. With
+    use_batch=True the classifications go through the OpenAI Batch API instead.
+    """
+    place_ids = get_unclassified_place_ids()
+    total = len(place_ids)
+
+    print(f"Processing {total} locations with {MAX_WORKERS} workers...")
+
+    if use_batch:
+        counts = main_batch(place_ids)
+    else:
+        counts = {"processed": 0, "skipped": 0, "error": 0}
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(process_one, place_id, attempts): place_id
+                for place_id, attempts in place_ids.items()
+            }
+            for idx, future in enumerate(as_completed(futures), 1):
+                place_id = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:
+                    print(f"✗ Unexpected error for {place_id}: {type(e).__name__}: {e}")
+                    status = "error"
+                counts[status] += 1
+                print(f"[{idx}/{total}] {place_id}: {status}")
 
     print(f"\n{'='*60}")
     print(f"Complete!")
-    print(f"  Processed: {processed}")
-    print(f"  Skipped: {skipped}")
-    print(f"  Errors: {errors}")
+    print(f"  Processed: {counts['processed']}")
+    print(f"  Skipped: {counts['skipped']}")
+    print(f"  Errors: {counts['error']}")
     print(f"{'='*60}")
 
 
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Classify location cover photos with OpenAI.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit classifications through the OpenAI Batch API (cheaper, up to 24h turnaround).",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
+    args = _parse_args()
+    main(use_batch=args.batch)
@@ -3,13 +3,18 @@ Main demonstration script for the Pinit recommendation pipeline.
 Showcases the pipeline steps with visualizations and analysis.
 """
 
-import json
 from pathlib import Path
+from typing import Dict, Tuple
+import numpy as np
+import orjson
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # figures are only saved to disk, never shown
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 from config import PipelineConfig, PipelinePaths, ReviewTagConfig
+from pipeline import SAVE_FORMATS, _write_table
 from recommendation.tag_taxonomy import get_tags_dataframe, get_tags_by_category
 from recommendation.static_tagging import load_locations, load_reviews, build_location_tags
 from recommendation.user_profiles import ensure_user_actions, build_user_tag_affinities
@@ -20,6 +25,35 @@ sns.set_style("whitegrid")
 plt.rcParams['figure.figsize'] = (12, 6)
 
 
+# One figure per panel layout, cleared and reused by the visualize_* functions
+_FIG_CACHE: Dict[Tuple[int, int, float, float], plt.Figure] = {}
+
+
+def _get_figure(nrows: int, ncols: int, figsize: Tuple[float, float]):
+    """Return a cleared cached figure with fresh axes for the given layout."""
+    key = (nrows, ncols, *figsize)
+    fig = _FIG_CACHE.get(key)
+    if fig is None:
+        fig = plt.figure(figsize=figsize)
+        _FIG_CACHE[key] = fig
+    else:
+        fig.clf()
+    return fig, fig.subplots(nrows, ncols)
+
+
+def _group_sizes(values: pd.Series) -> pd.Series:
+    """Rows per distinct value (like groupby(...).size(), without the group index)."""
+    codes, _ = pd.factorize(values)
+    return pd.Series(np.bincount(codes[codes >= 0]))
+
+
+def _top_counts(values: pd.Series, n: int) -> pd.Series:
+    """The n most frequent values with their counts (like value_counts().head(n))."""
+    uniques, counts = np.unique(values.dropna().to_numpy(), return_counts=True)
+    order = np.argsort(-counts, kind="stable")[:n]
+    return pd.Series(counts[order], index=uniques[order])
+
+
 def print_section(title: str):
     """Print a formatted section header."""
     print(f"\n{'='*80}")
@@ -39,34 +73,36 @@ def visualize_tags(tags_df: pd.DataFrame, output_dir: Path):
         print(f"  {tag_type:15s}: {count:3d} tags")
     
     # Plot tag distribution
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig, ax = _get_figure(1, 1, (10, 6))
     tag_counts.plot(kind='bar', ax=ax, color='steelblue')
     ax.set_title('Tag Distribution by Type', fontsize=14, fontweight='bold')
     ax.set_xlabel('Tag Type', fontsize=12)
     ax.set_ylabel('Number of Tags', fontsize=12)
     ax.tick_params(axis='x', rotation=45)
-    plt.tight_layout()
-    plt.savefig(output_dir / 'tag_distribution.png', dpi=300)
+    fig.tight_layout()
+    fig.savefig(output_dir / 'tag_distribution.png', dpi=300)
     print(f"\n✓ Saved: {output_dir / 'tag_distribution.png'}")
-    plt.close()
 
 
 def visualize_locations(locations: pd.DataFrame, output_dir: Path):
     """Create visualizations for location data."""
     print_section("LOCATION INVENTORY ANALYSIS")
     
+    rating_clean = locations['rating'].dropna().to_numpy()
+    mean_rating = rating_clean.mean() if len(rating_clean) else float('nan')
+    
     print(f"Total locations: {len(locations):,}")
-    print(f"Average rating: {locations['rating'].mean():.2f}")
+    print(f"Average rating: {mean_rating:.2f}")
     print(f"Total reviews: {locations['user_ratings_total'].sum():,.0f}")
     
     # Cuisine distribution
-    top_cuisines = locations['cuisine_primary'].value_counts().head(10)
+    top_cuisines = _top_counts(locations['cuisine_primary'], 10)
     print(f"\nTop 10 cuisines:")
     for cuisine, count in top_cuisines.items():
         print(f"  {cuisine:20s}: {count:3d} locations")
     
     # Create visualizations
-    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    fig, axes = _get_figure(2, 2, (14, 10))
     
     # 1. Cuisine distribution
     top_cuisines.plot(kind='barh', ax=axes[0, 0], color='coral')
@@ -74,11 +110,11 @@ def visualize_locations(locations: pd.DataFrame, output_dir: Path):
     axes[0, 0].set_xlabel('Number of Locations')
     
     # 2. Rating distribution
-    axes[0, 1].hist(locations['rating'].dropna(), bins=20, color='lightblue', edgecolor='black')
+    axes[0, 1].hist(rating_clean, bins=20, color='lightblue', edgecolor='black')
     axes[0, 1].set_title('Rating Distribution', fontsize=12, fontweight='bold')
     axes[0, 1].set_xlabel('Rating')
     axes[0, 1].set_ylabel('Frequency')
-    axes[0, 1].axvline(locations['rating'].mean(), color='red', linestyle='--', label='Mean')
+    axes[0, 1].axvline(mean_rating, color='red', linestyle='--', label='Mean')
     axes[0, 1].legend()
     
     # 3. Price level distribution
@@ -89,37 +125,42 @@ def visualize_locations(locations: pd.DataFrame, output_dir: Path):
     axes[1, 0].set_ylabel('Count')
     
     # 4. Review count vs rating scatter
-    sample = locations.sample(min(500, len(locations)))
-    axes[1, 1].scatter(sample['user_ratings_total'], sample['rating'], alpha=0.5, color='purple')
+    # Sample row positions and read only the two plotted columns
+    sample_idx = np.random.default_rng(0).choice(len(locations), min(500, len(locations)), replace=False)
+    axes[1, 1].scatter(
+        locations['user_ratings_total'].to_numpy()[sample_idx],
+        locations['rating'].to_numpy()[sample_idx],
+        alpha=0.5,
+        color='purple'
+    )
     axes[1, 1].set_title('Reviews vs Rating', fontsize=12, fontweight='bold')
     axes[1, 1].set_xlabel('Number of Reviews')
     axes[1, 1].set_ylabel('Rating')
     axes[1, 1].set_xscale('log')
     
-    plt.tight_layout()
-    plt.savefig(output_dir / 'location_analysis.png', dpi=300)
+    fig.tight_layout()
+    fig.savefig(output_dir / 'location_analysis.png', dpi=300)
     print(f"\n✓ Saved: {output_dir / 'location_analysis.png'}")
-    plt.close()
 
 
-def visualize_location_tags(location_tags: pd.DataFrame, tags_df: pd.DataFrame, output_dir: Path):
+def visualize_location_tags(location_tags: pd.DataFrame, tag_names: Dict[str, str], output_dir: Path):
     """Create visualizations for location tagging."""
     print_section("LOCATION TAGGING ANALYSIS")
     
+    # Tags per location
+    tags_per_location = _group_sizes(location_tags['location_id'])
+    
     print(f"Total location-tag pairs: {len(location_tags):,}")
-    print(f"Unique locations tagged: {location_tags['location_id'].nunique():,}")
+    print(f"Unique locations tagged: {len(tags_per_location):,}")
     print(f"Unique tags used: {location_tags['tag_id'].nunique():,}")
     
-    # Tags per location
-    tags_per_location = location_tags.groupby('location_id').size()
     print(f"\nTags per location:")
     print(f"  Mean: {tags_per_location.mean():.1f}")
     print(f"  Median: {tags_per_location.median():.0f}")
     print(f"  Max: {tags_per_location.max():.0f}")
     
     # Most common tags
-    tag_usage = location_tags['tag_id'].value_counts().head(15)
-    tag_names = tags_df.set_index('tag_id')['text'].to_dict()
+    tag_usage = _top_counts(location_tags['tag_id'], 15)
     
     print(f"\nMost frequently used tags:")
     for tag_id, count in tag_usage.items():
@@ -127,7 +168,7 @@ def visualize_location_tags(location_tags: pd.DataFrame, tags_df: pd.DataFrame,
         print(f"  {tag_name:25s}: {count:4d} locations")
     
     # Visualizations
-    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    fig, axes = _get_figure(1, 2, (14, 6))
     
     # 1. Tags per location histogram
     axes[0].hist(tags_per_location, bins=30, color='teal', edgecolor='black')
@@ -146,22 +187,22 @@ def visualize_location_tags(location_tags: pd.DataFrame, tags_df: pd.DataFrame,
     axes[1].set_xlabel('Number of Locations')
     axes[1].invert_yaxis()
     
-    plt.tight_layout()
-    plt.savefig(output_dir / 'location_tags_analysis.png', dpi=300)
+    fig.tight_layout()
+    fig.savefig(output_dir / 'location_tags_analysis.png', dpi=300)
     print(f"\n✓ Saved: {output_dir / 'location_tags_analysis.png'}")
-    plt.close()
 
 
-def visualize_user_profiles(user_tags: pd.DataFrame, tags_df: pd.DataFrame, output_dir: Path):
+def visualize_user_profiles(user_tags: pd.DataFrame, tag_names: Dict[str, str], output_dir: Path):
     """Create visualizations for user taste profiles."""
     print_section("USER TASTE PROFILES")
     
-    n_users = user_tags['user_id'].nunique()
+    # Affinities per user
+    affinities_per_user = _group_sizes(user_tags['user_id'])
+    
+    n_users = len(affinities_per_user)
     print(f"Total users: {n_users}")
     print(f"Total user-tag affinities: {len(user_tags):,}")
     
-    # Affinities per user
-    affinities_per_user = user_tags.groupby('user_id').size()
     print(f"\nTag affinities per user:")
     print(f"  Mean: {affinities_per_user.mean():.1f}")
     print(f"  Median: {affinities_per_user.median():.0f}")
@@ -169,7 +210,6 @@ def visualize_user_profiles(user_tags: pd.DataFrame, tags_df: pd.DataFrame, outp
     # Top tags across all users
     avg_score_by_tag = user_tags.groupby('tag_id')['score'].agg(['mean', 'count'])
     top_tags = avg_score_by_tag.nlargest(10, 'mean')
-    tag_names = tags_df.set_index('tag_id')['text'].to_dict()
     
     print(f"\nTop tags by average score:")
     for tag_id, row in top_tags.iterrows():
@@ -177,7 +217,7 @@ def visualize_user_profiles(user_tags: pd.DataFrame, tags_df: pd.DataFrame, outp
         print(f"  {tag_name:25s}: {row['mean']:.1f} (n={int(row['count'])})")
     
     # Visualizations
-    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    fig, axes = _get_figure(1, 2, (14, 6))
     
     # 1. Affinities per user
     axes[0].hist(affinities_per_user, bins=20, color='orchid', edgecolor='black')
@@ -194,39 +234,39 @@ def visualize_user_profiles(user_tags: pd.DataFrame, tags_df: pd.DataFrame, outp
     axes[1].set_xlabel('Average Score')
     axes[1].invert_yaxis()
     
-    plt.tight_layout()
-    plt.savefig(output_dir / 'user_profiles_analysis.png', dpi=300)
+    fig.tight_layout()
+    fig.savefig(output_dir / 'user_profiles_analysis.png', dpi=300)
     print(f"\n✓ Saved: {output_dir / 'user_profiles_analysis.png'}")
-    plt.close()
 
 
-def visualize_recommendations(recs: pd.DataFrame, locations: pd.DataFrame, output_dir: Path):
+def visualize_recommendations(recs: pd.DataFrame, location_names: Dict[int, str], output_dir: Path):
     """Create visualizations for recommendations."""
     print_section("RECOMMENDATION RESULTS")
     
-    n_users = recs['user_id'].nunique()
+    # Recs per user
+    recs_per_user = _group_sizes(recs['user_id'])
+    
+    n_users = len(recs_per_user)
     n_locations = recs['location_id'].nunique()
     
     print(f"Recommendations generated for {n_users} users")
     print(f"Unique locations recommended: {n_locations}")
     print(f"Total recommendations: {len(recs):,}")
     
-    # Recs per user
-    recs_per_user = recs.groupby('user_id').size()
     print(f"\nRecommendations per user:")
     print(f"  Mean: {recs_per_user.mean():.1f}")
     print(f"  Median: {recs_per_user.median():.0f}")
     
     # Score distribution
+    score_stats = recs['score'].agg(['mean', 'median', 'min', 'max'])
     print(f"\nScore distribution:")
-    print(f"  Mean: {recs['score'].mean():.2f}")
-    print(f"  Median: {recs['score'].median():.2f}")
-    print(f"  Min: {recs['score'].min():.2f}")
-    print(f"  Max: {recs['score'].max():.2f}")
+    print(f"  Mean: {score_stats['mean']:.2f}")
+    print(f"  Median: {score_stats['median']:.2f}")
+    print(f"  Min: {score_stats['min']:.2f}")
+    print(f"  Max: {score_stats['max']:.2f}")
     
     # Most recommended locations
-    top_recommended = recs['location_id'].value_counts().head(10)
-    location_names = locations.set_index('location_id')['name'].to_dict()
+    top_recommended = _top_counts(recs['location_id'], 10)
     
     print(f"\nMost frequently recommended locations:")
     for loc_id, count in top_recommended.items():
@@ -234,7 +274,7 @@ def visualize_recommendations(recs: pd.DataFrame, locations: pd.DataFrame, outpu
         print(f"  {loc_name[:40]:40s}: {count:3d} users")
     
     # Visualizations
-    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    fig, axes = _get_figure(2, 2, (14, 10))
     
     # 1. Recommendations per user
     axes[0, 0].hist(recs_per_user, bins=20, color='skyblue', edgecolor='black')
@@ -263,10 +303,9 @@ def visualize_recommendations(recs: pd.DataFrame, locations: pd.DataFrame, outpu
     axes[1, 1].set_xlabel('Rank')
     axes[1, 1].set_ylabel('Frequency')
     
-    plt.tight_layout()
-    plt.savefig(output_dir / 'recommendations_analysis.png', dpi=300)
+    fig.tight_layout()
+    fig.savefig(output_dir / 'recommendations_analysis.png', dpi=300)
     print(f"\n✓ Saved: {output_dir / 'recommendations_analysis.png'}")
-    plt.close()
 
 
 def main():
@@ -282,6 +321,8 @@ def main():
     paths = PipelinePaths(data_dir=DATA_DIR, city_name=CITY_NAME, output_dir=OUTPUT_DIR)
     review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
     config = PipelineConfig(paths=paths, review_tagging=review_cfg, top_k_per_user=25, synthetic_users=True)
+    if config.save_format not in SAVE_FORMATS:
+        raise ValueError(f"Unsupported save_format {config.save_format!r}; expected one of {sorted(SAVE_FORMATS)}")
     
     print(f"Data directory: {DATA_DIR.resolve()}")
     print(f"Output directory: {OUTPUT_DIR.resolve()}")
@@ -291,23 +332,28 @@ def main():
     print_section("STEP 1: LOAD TAGS FROM SUPABASE")
     tags_df = get_tags_dataframe()
     print(f"✓ Loaded {len(tags_df)} tags from Supabase")
+    tag_names = dict(zip(tags_df["tag_id"].tolist(), tags_df["text"].tolist()))
     visualize_tags(tags_df, OUTPUT_DIR)
     
     # Step 2: Load locations
     print_section("STEP 2: LOAD LOCATION INVENTORY")
     locations = load_locations(paths)
     print(f"✓ Loaded {len(locations):,} locations")
+    location_names = dict(zip(locations["location_id"].tolist(), locations["name"].tolist()))
     visualize_locations(locations, OUTPUT_DIR)
     
     # Step 3: Load reviews and build location tags
     print_section("STEP 3: BUILD LOCATION TAGS")
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
+    place_lookup = dict(zip(
+        locations["google_place_id"].tolist(),
+        locations["location_id"].tolist(),
+    ))
     reviews = load_reviews(paths, place_lookup)
     print(f"✓ Loaded {len(reviews):,} reviews")
     
     location_tags = build_location_tags(locations, reviews, config.review_tagging)
     print(f"✓ Generated {len(location_tags):,} location-tag pairs")
-    visualize_location_tags(location_tags, tags_df, OUTPUT_DIR)
+    visualize_location_tags(location_tags, tag_names, OUTPUT_DIR)
     
     # Step 4: Build user profiles
     print_section("STEP 4: BUILD USER TASTE PROFILES")
@@ -318,7 +364,7 @@ def main():
     
     user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
     print(f"✓ Computed {len(user_tags):,} user-tag affinities for {user_tags['user_id'].nunique()} users")
-    visualize_user_profiles(user_tags, tags_df, OUTPUT_DIR)
+    visualize_user_profiles(user_tags, tag_names, OUTPUT_DIR)
     
     # Step 5: Generate recommendations
     print_section("STEP 5: GENERATE RECOMMENDATIONS")
@@ -326,16 +372,21 @@ def main():
         locations, user_tags, location_tags, user_history, user_actions, config
     )
     print(f"✓ Generated {len(recommendations):,} recommendations")
-    visualize_recommendations(recommendations, locations, OUTPUT_DIR)
+    visualize_recommendations(recommendations, location_names, OUTPUT_DIR)
     
     # Step 6: Save outputs (no Supabase upload)
     print_section("STEP 6: SAVE OUTPUTS")
-    locations.to_csv(OUTPUT_DIR / "locations.csv", index=False)
-    tags_df.to_csv(OUTPUT_DIR / "tags.csv", index=False)
-    location_tags.to_csv(OUTPUT_DIR / "location_tags.csv", index=False)
-    user_tags.to_csv(OUTPUT_DIR / "user_tag_affinities.csv", index=False)
-    user_history.to_csv(OUTPUT_DIR / "user_history.csv", index=False)
-    recommendations.to_csv(OUTPUT_DIR / "user_recommendations.csv", index=False)
+    outputs = {
+        "locations": locations,
+        "tags": tags_df,
+        "location_tags": location_tags,
+        "user_tag_affinities": user_tags,
+        "user_history": user_history,
+        "user_recommendations": recommendations,
+    }
+    suffix = SAVE_FORMATS[config.save_format]
+    for name, df in outputs.items():
+        _write_table(df, OUTPUT_DIR / f"{name}{suffix}", config.save_format)
     
     metadata = {
         "city": CITY_NAME,
@@ -346,14 +397,10 @@ def main():
         "n_recommendations": int(len(recommendations)),
         "synthetic_user_actions": synthetic,
     }
-    (OUTPUT_DIR / "metadata.json").write_text(json.dumps(metadata, indent=2))
-    
-    print(f"✓ Saved locations.csv ({len(locations):,} rows)")
-    print(f"✓ Saved tags.csv ({len(tags_df):,} rows)")
-    print(f"✓ Saved location_tags.csv ({len(location_tags):,} rows)")
-    print(f"✓ Saved user_tag_affinities.csv ({len(user_tags):,} rows)")
-    print(f"✓ Saved user_history.csv ({len(user_history):,} rows)")
-    print(f"✓ Saved user_recommendations.csv ({len(recommendations):,} rows)")
+    (OUTPUT_DIR / "metadata.json").write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    
+    for name, df in outputs.items():
+        print(f"✓ Saved {name}{suffix} ({len(df):,} rows)")
     print(f"✓ Saved metadata.json")
     
     print_section("PIPELINE COMPLETE!")
@@ -1,27 +1,57 @@
 from __future__ import annotations
 
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict
 
+import orjson
+import pandas as pd
+
 from config import PipelineConfig, PipelinePaths, ReviewTagConfig
 from recommendation.recommendation import build_recommendations
 from recommendation.tag_taxonomy import get_tags_dataframe
-from recommendation.tagging import build_location_tags, load_locations, load_reviews
+from recommendation.static_tagging import build_location_tags, load_locations, load_reviews
 from recommendation.user_profiles import (
     build_user_tag_affinities,
     ensure_user_actions,
 )
 
 
+# Output key -> file stem; the suffix follows PipelineConfig.save_format
+OUTPUT_TABLES = {
+    "locations": "locations",
+    "tags": "tags",
+    "location_tags": "location_tags",
+    "user_tags": "user_tag_affinities",
+    "user_history": "user_history",
+    "user_recommendations": "user_recommendations",
+}
+SAVE_FORMATS = {"parquet": ".parquet", "csv": ".csv"}
+CSV_BUFFER_BYTES = 1 << 20
+
+
+def _write_table(df: pd.DataFrame, path: Path, save_format: str) -> None:
+    if save_format == "parquet":
+        df.to_parquet(path, index=False, compression="zstd", engine="pyarrow")
+    else:
+        with open(path, "wb", buffering=CSV_BUFFER_BYTES) as fh:
+            df.to_csv(fh, index=False)
+
+
 def run_pipeline(config: PipelineConfig) -> Dict[str, Path]:
     paths = config.paths
     output_dir = paths.output_dir
     output_dir.mkdir(parents=True, exist_ok=True)
+    if config.save_format not in SAVE_FORMATS:
+        raise ValueError(f"Unsupported save_format {config.save_format!r}; expected one of {sorted(SAVE_FORMATS)}")
+    suffix = SAVE_FORMATS[config.save_format]
 
     locations = load_locations(paths)
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
+    place_lookup = dict(zip(
+        locations["google_place_id"].tolist(),
+        locations["location_id"].tolist(),
+    ))
     reviews = load_reviews(paths, place_lookup)
     tags = get_tags_dataframe()
     location_tags = build_location_tags(locations, reviews, config.review_tagging)
@@ -40,22 +70,25 @@ def run_pipeline(config: PipelineConfig) -> Dict[str, Path]:
         config,
     )
 
-    outputs = {
-        "locations": output_dir / "locations.csv",
-        "tags": output_dir / "tags.csv",
-        "location_tags": output_dir / "location_tags.csv",
-        "user_tags": output_dir / "user_tag_affinities.csv",
-        "user_history": output_dir / "user_history.csv",
-        "user_recommendations": output_dir / "user_recommendations.csv",
-        "metadata": output_dir / "metadata.json",
+    tables = {
+        "locations": locations,
+        "tags": tags,
+        "location_tags": location_tags,
+        "user_tags": user_tags,
+        "user_history": user_history,
+        "user_recommendations": recommendations,
     }
-
-    locations.to_csv(outputs["locations"], index=False)
-    tags.to_csv(outputs["tags"], index=False)
-    location_tags.to_csv(outputs["location_tags"], index=False)
-    user_tags.to_csv(outputs["user_tags"], index=False)
-    user_history.to_csv(outputs["user_history"], index=False)
-    recommendations.to_csv(outputs["user_recommendations"], index=False)
+    outputs = {key: output_dir / f"{stem}{suffix}" for key, stem in OUTPUT_TABLES.items()}
+    outputs["metadata"] = output_dir / "metadata.json"
+
+    # The writers spend most of their time in native code, so the files are written concurrently
+    with ThreadPoolExecutor(max_workers=len(tables)) as pool:
+        futures = [
+            pool.submit(_write_table, df, outputs[key], config.save_format)
+            for key, df in tables.items()
+        ]
+        for future in futures:
+            future.result()
 
     metadata = {
         "city": paths.city_name,
@@ -66,7 +99,7 @@ def run_pipeline(config: PipelineConfig) -> Dict[str, Path]:
         "n_recommendations": int(len(recommendations)),
         "synthetic_user_actions": synthetic,
     }
-    outputs["metadata"].write_text(json.dumps(metadata, indent=2))
+    outputs["metadata"].write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
     return outputs
 
 
@@ -82,6 +115,7 @@ def _parse_args() -> argparse.Namespace:
     parser.add_argument("--no-synthesize-users", action="store_true", help="Disable synthetic user generation fallback.")
     parser.add_argument("--review-min-authors", type=int, default=2, help="Min distinct authors for review-derived tags.")
     parser.add_argument("--review-min-mentions", type=int, default=3, help="Min mentions for review-derived tags.")
+    parser.add_argument("--save-format", choices=sorted(SAVE_FORMATS), default="parquet", help="File format for the output tables.")
     return parser.parse_args()
 
 
@@ -102,6 +136,7 @@ def main():
         review_tagging=review_cfg,
         synthetic_users=not args.no_synthesize_users,
         top_k_per_user=args.top_k,
+        save_format=args.save_format,
     )
     run_pipeline(config)
     print(f"[pinit] Recommendation artifacts saved to: {paths.output_dir.resolve()}")
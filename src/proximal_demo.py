@@ -3,7 +3,11 @@ Demo script for proximal (location-based) recommendations.
 Shows how to get personalized recommendations within a geographic radius.
 """
 
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict
+import numpy as np
 import pandas as pd
 
 from config import PipelineConfig, PipelinePaths, ReviewTagConfig
@@ -13,11 +17,74 @@ from recommendation.user_profiles import ensure_user_actions, build_user_tag_aff
 from recommendation.proximal_recommendation import (
     build_proximal_recommendations,
     build_batch_proximal_recommendations,
+    build_location_index,
+    build_taste_matrix,
+    LocationIndex,
     ProximalConfig,
+    TasteMatrix,
     get_location_coordinates
 )
 
 
+DATA_DIR = Path("data/raw")
+OUTPUT_DIR = Path("output/proximal_demo")
+CSV_BUFFER_BYTES = 1 << 20
+
+
+@dataclass(frozen=True, eq=False)
+class CityData:
+    """City-wide tables shared by the demos (built once per city)."""
+    tags_df: pd.DataFrame
+    tag_names: Dict[str, str]  # tag_id -> display text
+    locations: pd.DataFrame
+    location_tags: pd.DataFrame
+    user_tags: pd.DataFrame
+    user_tags_indexed: pd.DataFrame  # user_tags indexed by user_id for profile lookups
+    user_history: pd.DataFrame
+    location_index: LocationIndex
+    taste_matrix: TasteMatrix
+
+
+@lru_cache(maxsize=4)
+def _load_city(city_name: str) -> CityData:
+    """Load and tag a city's data once; later demos reuse the same tables."""
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    
+    paths = PipelinePaths(data_dir=DATA_DIR, city_name=city_name, output_dir=OUTPUT_DIR)
+    review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
+    config = PipelineConfig(paths=paths, review_tagging=review_cfg, synthetic_users=True)
+    
+    print("Loading data...")
+    tags_df = get_tags_dataframe()
+    locations = load_locations(paths)
+    place_lookup = dict(zip(locations["google_place_id"].tolist(), locations["location_id"].tolist()))
+    reviews = load_reviews(paths, place_lookup)
+    location_tags = build_location_tags(locations, reviews, config.review_tagging)
+    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
+    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
+    
+    return CityData(
+        tags_df=tags_df,
+        tag_names=dict(zip(tags_df['tag_id'].tolist(), tags_df['text'].tolist())),
+        locations=locations,
+        location_tags=location_tags,
+        user_tags=user_tags,
+        user_tags_indexed=user_tags.set_index('user_id', drop=False),
+        user_history=user_history,
+        # One spatial index and one set of sparse taste matrices serve every query
+        location_index=build_location_index(locations, dtype=np.float32),
+        taste_matrix=build_taste_matrix(user_tags, location_tags)
+    )
+
+
+def _write_recs(df: pd.DataFrame, path: Path, parquet: bool = False) -> None:
+    """Write recommendations as CSV, plus a zstd Parquet copy when requested."""
+    with open(path, "wb", buffering=CSV_BUFFER_BYTES) as fh:
+        df.to_csv(fh, index=False)
+    if parquet:
+        df.to_parquet(path.with_suffix(".parquet"), index=False, compression="zstd", engine="pyarrow")
+
+
 def print_section(title: str):
     """Print a formatted section header."""
     print(f"\n{'='*80}")
@@ -59,32 +126,15 @@ def demo_single_user():
     """Demo: Recommendations for a single user at a specific location."""
     print_section("PROXIMAL RECOMMENDATION DEMO - SINGLE USER")
     
-    # Setup
-    DATA_DIR = Path("data/raw")
-    CITY_NAME = "london"
-    OUTPUT_DIR = Path("output/proximal_demo")
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
-    paths = PipelinePaths(data_dir=DATA_DIR, city_name=CITY_NAME, output_dir=OUTPUT_DIR)
-    review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
-    config = PipelineConfig(paths=paths, review_tagging=review_cfg, synthetic_users=True)
-    
-    # Load data
-    print("Loading data...")
-    tags_df = get_tags_dataframe()
-    locations = load_locations(paths)
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
-    reviews = load_reviews(paths, place_lookup)
-    location_tags = build_location_tags(locations, reviews, config.review_tagging)
+    # Load data (shared with the other demos)
+    city = _load_city("london")
+    tags_df, locations, location_tags = city.tags_df, city.locations, city.location_tags
+    user_tags, location_index = city.user_tags, city.location_index
+    taste_matrix = city.taste_matrix
     
     print(f"✓ Loaded {len(locations):,} locations")
     print(f"✓ Loaded {len(tags_df)} tags")
     print(f"✓ Created {len(location_tags):,} location-tag associations")
-    
-    # Build user profiles
-    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
-    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
-    
     print(f"✓ Generated profiles for {user_tags['user_id'].nunique()} users")
     
     # Pick a test location (e.g., central London)
@@ -99,9 +149,9 @@ def demo_single_user():
     print(f"👤 User: {test_user}")
     
     # Show user's taste profile
-    user_profile = user_tags[user_tags['user_id'] == test_user].head(5)
+    user_profile = city.user_tags_indexed.loc[[test_user]].head(5)
     print(f"\n🎯 User's top taste preferences:")
-    tag_names = tags_df.set_index('tag_id')['text'].to_dict()
+    tag_names = city.tag_names
     for _, tag in user_profile.iterrows():
         tag_name = tag_names.get(tag['tag_id'], tag.get('tag_text', 'Unknown'))
         print(f"   • {tag_name}: {tag['score']:.0f}/100")
@@ -128,7 +178,9 @@ def demo_single_user():
             locations,
             user_tags,
             location_tags,
-            proximal_config
+            proximal_config,
+            taste_matrix=taste_matrix,
+            location_index=location_index
         )
         
         display_recommendations(recs, f"Top {len(recs)} recommendations within {radius}km")
@@ -136,7 +188,7 @@ def demo_single_user():
         if not recs.empty:
             # Save to CSV
             output_file = OUTPUT_DIR / f"recs_{test_user}_radius_{radius}km.csv"
-            recs.to_csv(output_file, index=False)
+            _write_recs(recs, output_file)
             print(f"\n✓ Saved to: {output_file}")
 
 
@@ -144,25 +196,11 @@ def demo_multiple_users():
     """Demo: Compare recommendations for different users at same location."""
     print_section("PROXIMAL RECOMMENDATION DEMO - MULTIPLE USERS")
     
-    # Setup
-    DATA_DIR = Path("data/raw")
-    CITY_NAME = "london"
-    OUTPUT_DIR = Path("output/proximal_demo")
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
-    paths = PipelinePaths(data_dir=DATA_DIR, city_name=CITY_NAME, output_dir=OUTPUT_DIR)
-    review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
-    config = PipelineConfig(paths=paths, review_tagging=review_cfg, synthetic_users=True)
-    
-    # Load data
-    print("Loading data...")
-    tags_df = get_tags_dataframe()
-    locations = load_locations(paths)
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
-    reviews = load_reviews(paths, place_lookup)
-    location_tags = build_location_tags(locations, reviews, config.review_tagging)
-    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
-    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
+    # Load data (shared with the other demos)
+    city = _load_city("london")
+    tags_df, locations, location_tags = city.tags_df, city.locations, city.location_tags
+    user_tags, location_index = city.user_tags, city.location_index
+    taste_matrix = city.taste_matrix
     
     # Shoreditch, London (trendy area)
     CENTER_LAT = 51.5254
@@ -182,7 +220,7 @@ def demo_multiple_users():
         quality_weight=0.2
     )
     
-    tag_names = tags_df.set_index('tag_id')['text'].to_dict()
+    tag_names = city.tag_names
     
     for user_id in all_users:
         print(f"\n{'='*80}")
@@ -190,7 +228,7 @@ def demo_multiple_users():
         print(f"{'='*80}")
         
         # Show user profile
-        user_profile = user_tags[user_tags['user_id'] == user_id].head(3)
+        user_profile = city.user_tags_indexed.loc[[user_id]].head(3)
         print(f"\n🎯 Top preferences:")
         for _, tag in user_profile.iterrows():
             tag_name = tag_names.get(tag['tag_id'], tag.get('tag_text', 'Unknown'))
@@ -204,7 +242,9 @@ def demo_multiple_users():
             locations,
             user_tags,
             location_tags,
-            proximal_config
+            proximal_config,
+            taste_matrix=taste_matrix,
+            location_index=location_index
         )
         
         display_recommendations(recs.head(5), f"\nTop 5 recommendations")
@@ -219,44 +259,32 @@ def demo_multiple_users():
         locations,
         user_tags,
         location_tags,
-        proximal_config
+        proximal_config,
+        taste_matrix=taste_matrix,
+        location_index=location_index
     )
     
     print(f"Generated {len(batch_recs)} total recommendations across {len(all_users)} users")
     
     # Save batch results
     output_file = OUTPUT_DIR / "batch_proximal_recommendations.csv"
-    batch_recs.to_csv(output_file, index=False)
-    print(f"✓ Saved to: {output_file}")
+    _write_recs(batch_recs, output_file, parquet=True)
+    print(f"✓ Saved to: {output_file} (and {output_file.with_suffix('.parquet').name})")
 
 
 def demo_location_to_location():
     """Demo: Recommendations near a specific restaurant."""
     print_section("PROXIMAL RECOMMENDATION DEMO - NEAR A LOCATION")
     
-    # Setup
-    DATA_DIR = Path("data/raw")
-    CITY_NAME = "london"
-    OUTPUT_DIR = Path("output/proximal_demo")
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
-    paths = PipelinePaths(data_dir=DATA_DIR, city_name=CITY_NAME, output_dir=OUTPUT_DIR)
-    review_cfg = ReviewTagConfig(min_unique_authors=2, min_mentions=3)
-    config = PipelineConfig(paths=paths, review_tagging=review_cfg, synthetic_users=True)
-    
-    # Load data
-    print("Loading data...")
-    tags_df = get_tags_dataframe()
-    locations = load_locations(paths)
-    place_lookup = locations.set_index("google_place_id")["location_id"].to_dict()
-    reviews = load_reviews(paths, place_lookup)
-    location_tags = build_location_tags(locations, reviews, config.review_tagging)
-    user_actions, synthetic = ensure_user_actions(paths, locations, location_tags, allow_synthetic=True)
-    user_tags, user_history = build_user_tag_affinities(user_actions, location_tags, locations)
+    # Load data (shared with the other demos)
+    city = _load_city("london")
+    tags_df, locations, location_tags = city.tags_df, city.locations, city.location_tags
+    user_tags, location_index = city.user_tags, city.location_index
+    taste_matrix = city.taste_matrix
     
     # Pick a reference location
     ref_location = locations.iloc[0]
-    ref_coords = get_location_coordinates(ref_location['location_id'], locations)
+    ref_coords = get_location_coordinates(ref_location['location_id'], locations, location_index)
     
     if ref_coords is None:
         print("❌ Reference location has no coordinates")
@@ -290,7 +318,9 @@ def demo_location_to_location():
         locations,
         user_tags,
         location_tags,
-        proximal_config
+        proximal_config,
+        taste_matrix=taste_matrix,
+        location_index=location_index
     )
     
     # Exclude the reference location itself
@@ -300,7 +330,7 @@ def demo_location_to_location():
     
     # Save
     output_file = OUTPUT_DIR / f"near_{ref_location['location_id']}.csv"
-    recs.to_csv(output_file, index=False)
+    _write_recs(recs, output_file)
     print(f"\n✓ Saved to: {output_file}")
 
 
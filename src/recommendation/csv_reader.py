@@ -0,0 +1,20 @@
+"""Arrow-backed CSV reading shared by the tagging and user-profile loaders."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+
+def read_csv(path: Path, column_types: Optional[Dict[str, pa.DataType]] = None) -> pd.DataFrame:
+    """Parse a CSV with Arrow's multithreaded reader, keeping pandas' empty-as-null behaviour."""
+    table = pacsv.read_csv(
+        path,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types=column_types or {}, strings_can_be_null=True),
+    )
+    return table.to_pandas()
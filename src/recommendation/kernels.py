@@ -0,0 +1,167 @@
+"""
+Compiled scoring kernels for the proximal recommender.
+
+The proximity decay and weighted blend are fused into a single pass over the
+candidates, and the haversine distance is available both as a scalar and as a
+one-pass loop over many points. When numba is installed the loops are
+JIT-compiled; otherwise equivalent math/NumPy implementations are used.
+
+The kernels are deliberately serial: the API already calls them from several
+threadpool workers at once, and numba's parallel runtime is not safe to enter
+concurrently from multiple threads.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional
+    njit = None
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _haversine_python(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_lat / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2)
+    return 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_KM
+
+
+def _haversine_array_numpy(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    lat0: float,
+    lon0: float,
+    out: np.ndarray
+) -> None:
+    lat0_rad = math.radians(lat0)
+    lats_rad = np.radians(lats)
+    a = (np.sin((lats_rad - lat0_rad) / 2) ** 2 +
+         math.cos(lat0_rad) * np.cos(lats_rad) * np.sin(np.radians(lons - lon0) / 2) ** 2)
+    np.multiply(np.arcsin(np.sqrt(a)), 2 * EARTH_RADIUS_KM, out=out)
+
+
+def _proximal_scores_numpy(
+    distances: np.ndarray,
+    taste: np.ndarray,
+    quality: np.ndarray,
+    radius_km: float,
+    w_taste: float,
+    w_prox: float,
+    w_qual: float,
+    out_prox: np.ndarray,
+    out_final: np.ndarray
+) -> None:
+    np.exp(-2.0 * distances / radius_km, out=out_prox)
+    base = w_prox * out_prox + w_qual * quality
+    np.multiply(taste, w_taste, out=out_final)
+    out_final += base
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _proximal_scores_kernel(
+        distances, taste, quality, radius_km, w_taste, w_prox, w_qual, out_prox, out_final
+    ):
+        n_users, n_locations = taste.shape
+        for j in range(n_locations):
+            prox = math.exp(-2.0 * distances[j] / radius_km)
+            out_prox[j] = prox
+            base = w_prox * prox + w_qual * quality[j]
+            for i in range(n_users):
+                out_final[i, j] = w_taste * taste[i, j] + base
+
+    # These return NaN for missing coordinates, so fastmath (which assumes
+    # no NaNs) stays off
+    _haversine_scalar = njit(cache=True)(_haversine_python)
+
+    @njit(cache=True)
+    def _haversine_array_kernel(lats, lons, lat0, lon0, out):
+        lat0_rad = math.radians(lat0)
+        cos_lat0 = math.cos(lat0_rad)
+        for j in range(lats.shape[0]):
+            lat_rad = math.radians(lats[j])
+            sin_dlat = math.sin((lat_rad - lat0_rad) / 2)
+            sin_dlon = math.sin(math.radians(lons[j] - lon0) / 2)
+            a = sin_dlat * sin_dlat + cos_lat0 * math.cos(lat_rad) * sin_dlon * sin_dlon
+            out[j] = 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_KM
+else:
+    _proximal_scores_kernel = _proximal_scores_numpy
+    _haversine_scalar = _haversine_python
+    _haversine_array_kernel = _haversine_array_numpy
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great circle distance in kilometers between two points."""
+    return _haversine_scalar(float(lat1), float(lon1), float(lat2), float(lon2))
+
+
+def haversine_array(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    lat0: float,
+    lon0: float
+) -> np.ndarray:
+    """
+    Great circle distances in kilometers from one point to many points.
+
+    Args:
+        lats, lons: (n,) point coordinates
+        lat0, lon0: Center point coordinates
+
+    Returns:
+        (n,) float64 distances (NaN where coordinates are missing)
+    """
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+
+    out = np.empty(lats.shape[0], dtype=np.float64)
+    _haversine_array_kernel(lats, lons, float(lat0), float(lon0), out)
+    return out
+
+
+def proximal_scores(
+    distances: np.ndarray,
+    taste: np.ndarray,
+    quality: np.ndarray,
+    radius_km: float,
+    w_taste: float,
+    w_prox: float,
+    w_qual: float,
+    dtype: type = np.float64
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Proximity scores and final weighted scores in one pass.
+
+    Args:
+        distances: (n_locations,) distances in km
+        taste: (n_users, n_locations) taste scores
+        quality: (n_locations,) quality scores
+        radius_km: Radius used for the exponential proximity decay
+        w_taste, w_prox, w_qual: Blend weights
+        dtype: Floating dtype of the inputs and outputs
+
+    Returns:
+        Tuple of (proximity (n_locations,), final (n_users, n_locations))
+    """
+    distances = np.ascontiguousarray(distances, dtype=dtype)
+    taste = np.ascontiguousarray(taste, dtype=dtype)
+    quality = np.ascontiguousarray(quality, dtype=dtype)
+
+    out_prox = np.empty(distances.shape[0], dtype=dtype)
+    out_final = np.empty(taste.shape, dtype=dtype)
+    _proximal_scores_kernel(
+        distances, taste, quality, float(radius_km),
+        float(w_taste), float(w_prox), float(w_qual), out_prox, out_final
+    )
+    return out_prox, out_final
@@ -8,12 +8,28 @@ from __future__ import annotations
 
 import math
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
 
 from config import PipelineConfig
+from recommendation.kernels import EARTH_RADIUS_KM, haversine_array, haversine_km, proximal_scores
+
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+# Scores live in [0, 1], so single precision is plenty and halves the bytes
+SCORE_DTYPE = np.float32
+# Up to this radius the flat-earth approximation stays well under 1% error
+CHEAP_RULER_MAX_KM = 50.0
+# Spatial-index queries over-fetch by this factor so no point the exact
+# distance check would keep is dropped (covers the cheap ruler's error, which
+# grows towards the poles, so polar centers use the bounding box instead)
+INDEX_RADIUS_MARGIN = 1.01
+INDEX_MAX_ABS_LAT = 80.0
 
 
 @dataclass
@@ -27,6 +43,95 @@ class ProximalConfig:
     quality_weight: float = 0.2  # Weight for quality metrics
 
 
+@dataclass
+class TasteMatrix:
+    """Sparse users x tags and locations x tags score matrices (scores scaled to 0-1)."""
+    user_index: Dict[str, int]  # user_id -> row of user_mat
+    location_ids: np.ndarray  # sorted location ids, row i of loc_mat is location_ids[i]
+    tag_index: Dict[Any, int]  # tag_id -> shared column index
+    user_mat: sparse.csr_matrix
+    loc_mat: sparse.csr_matrix
+
+
+def build_taste_matrix(user_tags: pd.DataFrame, location_tags: pd.DataFrame) -> TasteMatrix:
+    """
+    Precompute the sparse matrices used for taste scoring.
+    
+    Args:
+        user_tags: User taste profile (user_id, tag_id, score)
+        location_tags: Location tag associations (location_id, tag_id, score)
+    
+    Returns:
+        TasteMatrix whose user/location rows share one tag column space
+    """
+    tag_codes, tag_values = pd.factorize(
+        pd.concat([user_tags['tag_id'], location_tags['tag_id']], ignore_index=True)
+    )
+    n_tags = len(tag_values)
+    user_tag_codes = tag_codes[:len(user_tags)]
+    loc_tag_codes = tag_codes[len(user_tags):]
+    
+    user_codes, user_values = pd.factorize(user_tags['user_id'])
+    user_mat = sparse.csr_matrix(
+        (user_tags['score'].to_numpy(dtype=np.float64) / 100.0, (user_codes, user_tag_codes)),
+        shape=(len(user_values), n_tags)
+    )
+    
+    loc_ids = location_tags['location_id'].to_numpy(dtype=np.int64)
+    location_ids = np.unique(loc_ids)
+    # Duplicate (location, tag) pairs are summed, matching the merge-based score
+    loc_mat = sparse.csr_matrix(
+        (location_tags['score'].to_numpy(dtype=np.float64) / 100.0,
+         (np.searchsorted(location_ids, loc_ids), loc_tag_codes)),
+        shape=(len(location_ids), n_tags)
+    )
+    
+    return TasteMatrix(
+        user_index={user_id: i for i, user_id in enumerate(user_values)},
+        location_ids=location_ids,
+        tag_index={tag_id: i for i, tag_id in enumerate(tag_values)},
+        user_mat=user_mat,
+        loc_mat=loc_mat,
+    )
+
+
+def taste_score_matrix(
+    taste_matrix: TasteMatrix,
+    user_ids: Sequence[str],
+    location_ids: Sequence[int]
+) -> np.ndarray:
+    """
+    Taste scores for every (user, location) pair as one sparse matmul.
+    
+    Args:
+        taste_matrix: Precomputed sparse score matrices
+        user_ids: Users to score (rows of the result)
+        location_ids: Locations to score (columns of the result)
+    
+    Returns:
+        Dense (len(user_ids), len(location_ids)) array of scores capped at 1.0
+    """
+    location_ids = np.asarray(location_ids, dtype=np.int64)
+    scores = np.zeros((len(user_ids), len(location_ids)), dtype=SCORE_DTYPE)
+    if len(taste_matrix.location_ids) == 0 or len(location_ids) == 0:
+        return scores
+    
+    user_rows = np.array([taste_matrix.user_index.get(u, -1) for u in user_ids], dtype=np.int64)
+    loc_rows = np.searchsorted(taste_matrix.location_ids, location_ids)
+    loc_rows = np.minimum(loc_rows, len(taste_matrix.location_ids) - 1)
+    known_users = user_rows >= 0
+    known_locs = taste_matrix.location_ids[loc_rows] == location_ids
+    
+    if known_users.any() and known_locs.any():
+        block = (
+            taste_matrix.user_mat[user_rows[known_users]]
+            @ taste_matrix.loc_mat[loc_rows[known_locs]].T
+        )
+        scores[np.ix_(known_users, known_locs)] = block.toarray()
+    
+    return np.minimum(scores, 1.0)
+
+
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calculate the great circle distance between two points on Earth.
@@ -39,27 +144,219 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     Returns:
         Distance in kilometers
     """
-    # Convert to radians
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
+    return haversine_km(lat1, lon1, lat2, lon2)
+
+
+def haversine_np(
+    lat0: float,
+    lon0: float,
+    lats: np.ndarray,
+    lons: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized haversine distance from one point to many points.
+    
+    Args:
+        lat0, lon0: Center point coordinates
+        lats, lons: Arrays of point coordinates
+    
+    Returns:
+        Array of distances in kilometers (NaN where coordinates are missing),
+        in the floating dtype of `lats`
+    """
+    lats = np.asarray(lats)
+    # Keep the center in the arrays' dtype so float32 inputs stay float32
+    lat0 = np.asarray(lat0, dtype=lats.dtype)
+    lon0 = np.asarray(lon0, dtype=lats.dtype)
+    
+    lat0_rad = np.radians(lat0)
+    lats_rad = np.radians(lats)
+    delta_lat = lats_rad - lat0_rad
+    delta_lon = np.radians(lons - lon0)
+    
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat0_rad) * np.cos(lats_rad) * np.sin(delta_lon / 2) ** 2)
+    c = 2 * np.arcsin(np.sqrt(a))
+    
+    return EARTH_RADIUS_KM * c
+
+
+def cheap_ruler_distance(
+    lat0: float,
+    lon0: float,
+    lats: np.ndarray,
+    lons: np.ndarray
+) -> np.ndarray:
+    """
+    Equirectangular ("cheap ruler") distance from one point to many points.
+    
+    Scales longitude differences by the cosine of the center latitude, so it
+    needs a single cosine instead of per-point trig. Only accurate for short
+    distances (see CHEAP_RULER_MAX_KM).
+    
+    Returns:
+        Array of distances in kilometers, in the floating dtype of `lats`
+    """
+    lats = np.asarray(lats)
+    lat0 = np.asarray(lat0, dtype=lats.dtype)
+    lon0 = np.asarray(lon0, dtype=lats.dtype)
+    
+    dy = lats - lat0
+    dx = (lons - lon0 + 180) % 360 - 180
+    dx *= np.cos(np.radians(lat0))
+    
+    return KM_PER_DEGREE * np.sqrt(dx * dx + dy * dy)
+
+
+def location_coordinate_arrays(
+    locations: pd.DataFrame,
+    dtype: type = np.float64
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Extract latitude/longitude columns as contiguous NumPy arrays.
+    
+    float32 is accurate to well under a metre for coordinates and halves the
+    memory traffic of the distance pass, so long-lived caches should use it.
+    
+    Args:
+        locations: DataFrame with 'lat' and 'lon' columns
+        dtype: Floating dtype of the returned arrays
+    
+    Returns:
+        Tuple of (lats, lons) arrays aligned with the rows of `locations`
+    """
+    lats = np.ascontiguousarray(locations['lat'].to_numpy(dtype=dtype, na_value=np.nan))
+    lons = np.ascontiguousarray(locations['lon'].to_numpy(dtype=dtype, na_value=np.nan))
+    return lats, lons
+
+
+@dataclass
+class LocationIndex:
+    """KD-tree over unit-sphere coordinates of a location inventory, built once per inventory."""
+    lats: np.ndarray  # row-aligned with the inventory
+    lons: np.ndarray
+    rows: np.ndarray  # inventory row of each tree point (rows with coordinates only)
+    tree: cKDTree
+    id_rows: Dict[int, int]  # location_id -> first inventory row with that id
+
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack((cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)))
+
+
+def build_location_index(locations: pd.DataFrame, dtype: type = np.float64) -> LocationIndex:
+    """
+    Build a spatial index for repeated radius queries over the same inventory.
+    
+    Points are placed on the unit sphere, where great-circle radius queries
+    become Euclidean (chord) ball queries that a KD-tree answers directly.
+    
+    Args:
+        locations: DataFrame with 'lat' and 'lon' columns
+        dtype: Floating dtype of the stored coordinate arrays
+    
+    Returns:
+        LocationIndex whose rows refer to positions in `locations`
+    """
+    lats, lons = location_coordinate_arrays(locations, dtype)
+    rows = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+    # Reversed so the first row wins for duplicate ids, as a boolean scan would
+    ids = locations['location_id'].tolist()
+    id_rows = dict(zip(reversed(ids), range(len(ids) - 1, -1, -1)))
+    return LocationIndex(
+        lats=lats,
+        lons=lons,
+        rows=rows,
+        tree=cKDTree(_unit_vectors(lats[rows], lons[rows])),
+        id_rows=id_rows
+    )
+
+
+def index_radius_candidates(
+    index: LocationIndex,
+    center_lat: float,
+    center_lon: float,
+    radius_km: float
+) -> np.ndarray:
+    """
+    Inventory rows that could be within the radius, in ascending row order.
     
-    # Haversine formula
-    a = (math.sin(delta_lat / 2) ** 2 + 
-         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2)
-    c = 2 * math.asin(math.sqrt(a))
+    Returns:
+        Superset of the rows within `radius_km` (exact distances are checked by the caller)
+    """
+    angular = radius_km / EARTH_RADIUS_KM * INDEX_RADIUS_MARGIN
+    if angular >= math.pi:
+        return index.rows
+    chord = 2.0 * math.sin(angular / 2.0)
+    hits = index.tree.query_ball_point(_unit_vectors([center_lat], [center_lon])[0], chord)
+    return np.sort(index.rows[np.asarray(hits, dtype=np.int64)])
+
+
+def index_nearest_rows(
+    index: LocationIndex,
+    center_lat: float,
+    center_lon: float,
+    k: int
+) -> np.ndarray:
+    """
+    Inventory rows of the k locations closest to the center, nearest first.
     
-    # Earth's radius in kilometers
-    r = 6371.0
+    Chord length on the unit sphere grows monotonically with great-circle
+    distance, so the tree's Euclidean neighbours are the exact nearest points.
+    """
+    k = min(k, len(index.rows))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    _, hits = index.tree.query(_unit_vectors([center_lat], [center_lon])[0], k=k)
+    return index.rows[np.atleast_1d(hits)]
+
+
+def bounding_box_mask(
+    center_lat: float,
+    center_lon: float,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    radius_km: float
+) -> np.ndarray:
+    """
+    Cheap lat/lon box test that keeps every point that could be within the radius.
     
-    return c * r
+    Args:
+        center_lat, center_lon: Center point coordinates
+        lats, lons: Arrays of point coordinates
+        radius_km: Radius in kilometers
+    
+    Returns:
+        Boolean mask (False for points outside the box or without coordinates)
+    """
+    # Angular radius, with a small margin so boundary points are never dropped
+    angular = radius_km / EARTH_RADIUS_KM * 1.001
+    dlat = math.degrees(angular)
+    
+    cos_lat = math.cos(math.radians(center_lat))
+    if angular >= math.pi / 2 or math.sin(angular) >= cos_lat:
+        # Circle reaches a pole: no usable longitude bound
+        dlon = 180.0
+    else:
+        dlon = math.degrees(math.asin(math.sin(angular) / cos_lat))
+    
+    mask = (lats >= center_lat - dlat) & (lats <= center_lat + dlat)
+    if dlon < 180.0:
+        # Wrap longitude differences into [-180, 180)
+        delta_lon = (lons - center_lon + 180.0) % 360.0 - 180.0
+        mask &= np.abs(delta_lon) <= dlon
+    return mask
 
 
 def calculate_distances(
     center_lat: float,
     center_lon: float,
-    locations: pd.DataFrame
+    locations: pd.DataFrame,
+    lats: Optional[np.ndarray] = None,
+    lons: Optional[np.ndarray] = None
 ) -> pd.Series:
     """
     Calculate distances from a center point to all locations.
@@ -67,24 +364,18 @@ def calculate_distances(
     Args:
         center_lat: Center point latitude
         center_lon: Center point longitude
-        locations: DataFrame with 'lat' and 'lng'/'lon' columns
+        locations: DataFrame with 'lat' and 'lon' columns
+        lats, lons: Optional precomputed coordinate arrays aligned with `locations`
     
     Returns:
         Series of distances in kilometers
     """
-    # Handle both 'lng' and 'lon' column names
-    lon_col = 'lng' if 'lng' in locations.columns else 'lon'
+    if lats is None or lons is None:
+        lats, lons = location_coordinate_arrays(locations)
     
-    distances = []
-    for _, row in locations.iterrows():
-        if pd.isna(row['lat']) or pd.isna(row[lon_col]):
-            distances.append(float('inf'))
-        else:
-            dist = haversine_distance(
-                center_lat, center_lon,
-                float(row['lat']), float(row[lon_col])
-            )
-            distances.append(dist)
+    distances = haversine_array(lats, lons, center_lat, center_lon)
+    # Locations without coordinates are never "nearby"
+    distances = np.where(np.isnan(distances), np.inf, distances)
     
     return pd.Series(distances, index=locations.index)
 
@@ -93,7 +384,10 @@ def filter_by_radius(
     center_lat: float,
     center_lon: float,
     locations: pd.DataFrame,
-    radius_km: float
+    radius_km: float,
+    lats: Optional[np.ndarray] = None,
+    lons: Optional[np.ndarray] = None,
+    location_index: Optional[LocationIndex] = None
 ) -> pd.DataFrame:
     """
     Filter locations within a specified radius.
@@ -103,16 +397,32 @@ def filter_by_radius(
         center_lon: Center point longitude
         locations: DataFrame with location data
         radius_km: Radius in kilometers
+        lats, lons: Optional precomputed coordinate arrays aligned with `locations`
+        location_index: Optional spatial index built from `locations`
     
     Returns:
         Filtered DataFrame with 'distance_km' column added
     """
-    distances = calculate_distances(center_lat, center_lon, locations)
+    if lats is None or lons is None:
+        if location_index is not None:
+            lats, lons = location_index.lats, location_index.lons
+        else:
+            lats, lons = location_coordinate_arrays(locations)
+    
+    # Only measure the points the index returns, or those inside the bounding box
+    if location_index is not None and abs(center_lat) < INDEX_MAX_ABS_LAT:
+        candidates = index_radius_candidates(location_index, center_lat, center_lon, radius_km)
+    else:
+        candidates = np.flatnonzero(
+            bounding_box_mask(center_lat, center_lon, lats, lons, radius_km)
+        )
+    distance_fn = cheap_ruler_distance if radius_km <= CHEAP_RULER_MAX_KM else haversine_np
+    distances = distance_fn(center_lat, center_lon, lats[candidates], lons[candidates])
+    within = np.flatnonzero(distances <= radius_km)
+    # Order by distance before gathering, so the rows are copied only once
+    within = within[np.argsort(distances[within], kind='stable')]
     
-    result = locations.copy()
-    result['distance_km'] = distances
-    result = result[result['distance_km'] <= radius_km]
-    result = result.sort_values('distance_km')
+    result = locations.iloc[candidates[within]].assign(distance_km=distances[within])
 
     print(f"Found {len(result)} locations within {radius_km} km radius.")
     
@@ -121,22 +431,28 @@ def filter_by_radius(
 
 def compute_taste_score(
     user_id: str,
-    location_ids: List[int],
+    location_ids: np.ndarray,
     user_tags: pd.DataFrame,
-    location_tags: pd.DataFrame
+    location_tags: pd.DataFrame,
+    taste_matrix: Optional[TasteMatrix] = None
 ) -> pd.Series:
     """
     Compute taste match scores for locations.
     
     Args:
         user_id: User identifier
-        location_ids: List of location IDs to score
+        location_ids: Array of location IDs to score
         user_tags: User taste profile
         location_tags: Location tag associations
+        taste_matrix: Optional precomputed sparse matrices (skips the merge)
     
     Returns:
         Series mapping location_id to taste score (0-1)
     """
+    if taste_matrix is not None:
+        scores = taste_score_matrix(taste_matrix, [user_id], location_ids)
+        return pd.Series(scores[0], index=location_ids)
+    
     user_profile = user_tags[user_tags['user_id'] == user_id]
     
     if user_profile.empty:
@@ -183,7 +499,7 @@ def compute_proximity_score(distances: pd.Series, max_distance: float) -> pd.Ser
         Series of proximity scores (0-1)
     """
     # Exponential decay: closer is much better
-    return np.exp(-2 * distances / max_distance)
+    return np.exp(-2 * distances.astype(SCORE_DTYPE) / max_distance)
 
 
 def compute_quality_score(locations: pd.DataFrame) -> pd.Series:
@@ -196,17 +512,104 @@ def compute_quality_score(locations: pd.DataFrame) -> pd.Series:
     Returns:
         Series of quality scores (0-1)
     """
+    rating = locations['rating'].to_numpy(dtype=SCORE_DTYPE, na_value=np.nan)
+    reviews = locations['user_ratings_total'].to_numpy(dtype=SCORE_DTYPE, na_value=np.nan)
+    
     # Normalize rating (assuming 0-5 scale)
-    rating_score = locations['rating'].fillna(3.0) / 5.0
+    rating_score = np.where(np.isnan(rating), SCORE_DTYPE(3.0), rating) / SCORE_DTYPE(5.0)
     
     # Log-scale review count (more reviews = more reliable)
-    review_score = np.log1p(locations['user_ratings_total'].fillna(0)) / 10.0
-    review_score = review_score.clip(upper=1.0)
+    review_score = np.log1p(np.where(np.isnan(reviews), SCORE_DTYPE(0.0), reviews)) / SCORE_DTYPE(10.0)
+    np.minimum(review_score, 1.0, out=review_score)
     
     # Combine: 70% rating, 30% review reliability
-    quality = (0.7 * rating_score + 0.3 * review_score).clip(upper=1.0)
+    quality = SCORE_DTYPE(0.7) * rating_score + SCORE_DTYPE(0.3) * review_score
+    np.minimum(quality, 1.0, out=quality)
+    
+    return pd.Series(quality, index=locations.index)
+
+
+# Columns returned by the proximal builders (when present in the inventory)
+OUTPUT_COLUMNS = [
+    'location_id', 'name', 'vicinity', 'cuisine_primary',
+    'rating', 'user_ratings_total', 'price_level',
+    'distance_km', 'taste_score', 'proximity_score',
+    'quality_score', 'final_score', 'rank'
+]
+
+EMPTY_RESULT_COLUMNS = [
+    'location_id', 'name', 'distance_km', 'taste_score',
+    'proximity_score', 'quality_score', 'final_score', 'rank'
+]
+
+
+def _nearby_locations(
+    center_lat: float,
+    center_lon: float,
+    locations: pd.DataFrame,
+    config: ProximalConfig,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    location_index: Optional[LocationIndex] = None
+) -> Tuple[pd.DataFrame, float]:
+    """
+    Find the candidate set, widening the radius when it is too small.
+    
+    A candidate set shorter than `min_results` is replaced by the
+    max(`min_results`, `max_results`) nearest locations, and the radius grows
+    to cover them. If nothing lies within twice the radius the area is
+    treated as empty. The nearest locations come from the spatial index when
+    one is given and from a full distance scan otherwise; both give the same
+    candidates.
     
-    return quality
+    Returns:
+        Tuple of (nearby locations with 'distance_km', radius used for proximity scoring)
+    """
+    radius_km = config.radius_km
+    nearby = filter_by_radius(
+        center_lat, center_lon, locations, radius_km, lats, lons, location_index
+    )
+    
+    if len(nearby) >= config.min_results:
+        return nearby, radius_km
+    
+    # Sparse area: take the k nearest locations instead of re-filtering at wider radii
+    k = max(config.min_results, config.max_results)
+    if location_index is not None:
+        rows = index_nearest_rows(location_index, center_lat, center_lon, k)
+        distances = haversine_np(center_lat, center_lon, lats[rows], lons[rows])
+    else:
+        all_distances = haversine_np(center_lat, center_lon, lats, lons)
+        valid = np.flatnonzero(~np.isnan(all_distances))
+        rows = valid[np.argsort(all_distances[valid], kind='stable')[:k]]
+        distances = all_distances[rows]
+    if nearby.empty and not (distances <= radius_km * 2).any():
+        # Nothing even at twice the radius: treat the area as empty
+        return nearby, radius_km
+    order = np.argsort(distances, kind='stable')
+    nearby = locations.iloc[rows[order]].assign(distance_km=distances[order])
+    if not nearby.empty:
+        radius_km = max(radius_km, float(distances[order[-1]]))
+    print(f"Using the {len(nearby)} nearest locations within {radius_km:.1f} km.")
+    return nearby, radius_km
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores along the last axis, best first.
+    
+    Uses argpartition so only the selected slice is fully sorted.
+    """
+    n = scores.shape[-1]
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(part, order, axis=-1)
 
 
 def build_proximal_recommendations(
@@ -216,7 +619,11 @@ def build_proximal_recommendations(
     locations: pd.DataFrame,
     user_tags: pd.DataFrame,
     location_tags: pd.DataFrame,
-    config: Optional[ProximalConfig] = None
+    config: Optional[ProximalConfig] = None,
+    lats: Optional[np.ndarray] = None,
+    lons: Optional[np.ndarray] = None,
+    taste_matrix: Optional[TasteMatrix] = None,
+    location_index: Optional[LocationIndex] = None
 ) -> pd.DataFrame:
     """
     Generate personalized recommendations within a geographic radius.
@@ -229,6 +636,9 @@ def build_proximal_recommendations(
         user_tags: User taste profiles
         location_tags: Location-tag associations
         config: Configuration parameters
+        lats, lons: Optional precomputed coordinate arrays aligned with `locations`
+        taste_matrix: Optional precomputed sparse taste matrices
+        location_index: Optional spatial index built from `locations`
     
     Returns:
         DataFrame with ranked recommendations including:
@@ -240,86 +650,61 @@ def build_proximal_recommendations(
         config = ProximalConfig()
     
     # Filter locations by radius
-    nearby = filter_by_radius(center_lat, center_lon, locations, config.radius_km)
+    if lats is None or lons is None:
+        if location_index is not None:
+            lats, lons = location_index.lats, location_index.lons
+        else:
+            lats, lons = location_coordinate_arrays(locations)
     
-    if nearby.empty:
-        # If nothing in radius, expand search
-        nearby = filter_by_radius(center_lat, center_lon, locations, config.radius_km * 2)
+    nearby, radius_km = _nearby_locations(
+        center_lat, center_lon, locations, config, lats, lons, location_index
+    )
     
     if nearby.empty:
-        return pd.DataFrame(columns=[
-            'location_id', 'name', 'distance_km', 'taste_score',
-            'proximity_score', 'quality_score', 'final_score', 'rank'
-        ])
+        return pd.DataFrame(columns=EMPTY_RESULT_COLUMNS)
     
     # Compute component scores
     taste_scores = compute_taste_score(
         user_id,
-        nearby['location_id'].tolist(),
+        nearby['location_id'].to_numpy(),
         user_tags,
-        location_tags
-    )
-    
-    proximity_scores = compute_proximity_score(
-        nearby['distance_km'],
-        config.radius_km
+        location_tags,
+        taste_matrix
     )
     
     quality_scores = compute_quality_score(nearby)
-    
-    # Combine scores
-    nearby_copy = nearby.copy()
-    nearby_copy['taste_score'] = nearby_copy['location_id'].map(taste_scores)
-    nearby_copy['proximity_score'] = proximity_scores.values
-    nearby_copy['quality_score'] = quality_scores.values
-    
-    # Calculate final weighted score
-    nearby_copy['final_score'] = (
-        config.taste_weight * nearby_copy['taste_score'] +
-        config.proximity_weight * nearby_copy['proximity_score'] +
-        config.quality_weight * nearby_copy['quality_score']
+    # Both score Series are already in `nearby` row order
+    taste_values = taste_scores.to_numpy(dtype=SCORE_DTYPE)
+    quality_values = quality_scores.to_numpy()
+    
+    # Proximity decay + weighted blend in one fused pass
+    proximity_values, final_values = proximal_scores(
+        nearby['distance_km'].to_numpy(),
+        taste_values[np.newaxis, :],
+        quality_values,
+        radius_km,
+        config.taste_weight,
+        config.proximity_weight,
+        config.quality_weight,
+        SCORE_DTYPE
     )
     
-    # Sort by final score
-    nearby_copy = nearby_copy.sort_values('final_score', ascending=False)
+    final_values = final_values[0]
     
-    # Add rank
-    nearby_copy['rank'] = range(1, len(nearby_copy) + 1)
+    # Select the top results by final score (only the selected slice is sorted)
+    top = _top_k_indices(final_values, config.max_results)
     
-    # Limit results
-    result = nearby_copy.head(config.max_results)
-    
-    # Ensure minimum results if possible
-    if len(result) < config.min_results and len(nearby_copy) < config.min_results:
-        # Expand radius if we don't have enough results
-        expanded = filter_by_radius(
-            center_lat, center_lon, locations, config.radius_km * 3
-        )
-        if len(expanded) > len(nearby):
-            # Recursively call with expanded radius
-            expanded_config = ProximalConfig(
-                radius_km=config.radius_km * 3,
-                min_results=config.min_results,
-                max_results=config.max_results,
-                taste_weight=config.taste_weight,
-                proximity_weight=config.proximity_weight,
-                quality_weight=config.quality_weight
-            )
-            return build_proximal_recommendations(
-                user_id, center_lat, center_lon, locations,
-                user_tags, location_tags, expanded_config
-            )
-    
-    # Select key columns for output
-    output_cols = [
-        'location_id', 'name', 'vicinity', 'cuisine_primary',
-        'rating', 'user_ratings_total', 'price_level',
-        'distance_km', 'taste_score', 'proximity_score',
-        'quality_score', 'final_score', 'rank'
-    ]
+    # Attach the scores to the selected rows only, in one assign
+    result = nearby.iloc[top].assign(
+        taste_score=taste_values[top],
+        proximity_score=proximity_values[top],
+        quality_score=quality_values[top],
+        final_score=final_values[top],
+        rank=np.arange(1, len(top) + 1)
+    )
     
     # Only include columns that exist
-    available_cols = [col for col in output_cols if col in result.columns]
+    available_cols = [col for col in OUTPUT_COLUMNS if col in result.columns]
     
     return result[available_cols].reset_index(drop=True)
 
@@ -331,11 +716,18 @@ def build_batch_proximal_recommendations(
     locations: pd.DataFrame,
     user_tags: pd.DataFrame,
     location_tags: pd.DataFrame,
-    config: Optional[ProximalConfig] = None
+    config: Optional[ProximalConfig] = None,
+    lats: Optional[np.ndarray] = None,
+    lons: Optional[np.ndarray] = None,
+    taste_matrix: Optional[TasteMatrix] = None,
+    location_index: Optional[LocationIndex] = None
 ) -> pd.DataFrame:
     """
     Generate proximal recommendations for multiple users.
     
+    All users share the same center, so the candidate set is computed once and
+    every user is scored in a single (users x candidates) sparse matmul.
+    
     Args:
         user_ids: List of user identifiers
         center_lat: Center point latitude
@@ -344,30 +736,74 @@ def build_batch_proximal_recommendations(
         user_tags: User taste profiles
         location_tags: Location-tag associations
         config: Configuration parameters
+        lats, lons: Optional precomputed coordinate arrays aligned with `locations`
+        taste_matrix: Optional precomputed sparse taste matrices
+        location_index: Optional spatial index built from `locations`
     
     Returns:
         Combined DataFrame with recommendations for all users
     """
-    all_recs = []
+    if config is None:
+        config = ProximalConfig()
     
-    for user_id in user_ids:
-        user_recs = build_proximal_recommendations(
-            user_id, center_lat, center_lon,
-            locations, user_tags, location_tags, config
-        )
-        if not user_recs.empty:
-            user_recs['user_id'] = user_id
-            all_recs.append(user_recs)
+    if lats is None or lons is None:
+        if location_index is not None:
+            lats, lons = location_index.lats, location_index.lons
+        else:
+            lats, lons = location_coordinate_arrays(locations)
     
-    if not all_recs:
+    nearby, radius_km = _nearby_locations(
+        center_lat, center_lon, locations, config, lats, lons, location_index
+    )
+    
+    if nearby.empty or not user_ids:
         return pd.DataFrame(columns=['user_id', 'location_id'])
     
-    return pd.concat(all_recs, ignore_index=True)
+    location_ids = nearby['location_id'].to_numpy()
+    if taste_matrix is None:
+        taste_matrix = build_taste_matrix(
+            user_tags[user_tags['user_id'].isin(user_ids)],
+            location_tags[location_tags['location_id'].isin(location_ids)]
+        )
+    
+    # (users x candidates) score matrix
+    taste = taste_score_matrix(taste_matrix, user_ids, location_ids)
+    quality = compute_quality_score(nearby).to_numpy()
+    proximity, final = proximal_scores(
+        nearby['distance_km'].to_numpy(),
+        taste,
+        quality,
+        radius_km,
+        config.taste_weight,
+        config.proximity_weight,
+        config.quality_weight,
+        SCORE_DTYPE
+    )
+    
+    # Top-k per user without sorting the full rows
+    top = _top_k_indices(final, config.max_results)
+    n_users, k = top.shape
+    user_rows = np.repeat(np.arange(n_users), k)
+    loc_cols = top.ravel()
+    
+    base_cols = [col for col in OUTPUT_COLUMNS if col in nearby.columns]
+    # One positional gather of just the output columns
+    result = nearby.iloc[loc_cols, nearby.columns.get_indexer(base_cols)].reset_index(drop=True)
+    result['taste_score'] = taste[user_rows, loc_cols]
+    result['proximity_score'] = proximity[loc_cols]
+    result['quality_score'] = quality[loc_cols]
+    result['final_score'] = final[user_rows, loc_cols]
+    result['rank'] = np.tile(np.arange(1, k + 1), n_users)
+    result['user_id'] = np.repeat(np.asarray(user_ids, dtype=object), k)
+    
+    output_cols = [col for col in OUTPUT_COLUMNS if col in result.columns] + ['user_id']
+    return result[output_cols]
 
 
 def get_location_coordinates(
     location_id: int,
-    locations: pd.DataFrame
+    locations: pd.DataFrame,
+    location_index: Optional[LocationIndex] = None
 ) -> Optional[Tuple[float, float]]:
     """
     Get coordinates for a specific location.
@@ -375,18 +811,24 @@ def get_location_coordinates(
     Args:
         location_id: Location identifier
         locations: Location inventory
+        location_index: Optional spatial index built from `locations` (hashed id lookup)
     
     Returns:
         Tuple of (latitude, longitude) or None if not found
     """
-    loc = locations[locations['location_id'] == location_id]
+    if location_index is not None:
+        row = location_index.id_rows.get(location_id)
+        if row is None:
+            return None
+        loc = locations.iloc[[row]]
+    else:
+        loc = locations[locations['location_id'] == location_id]
     
     if loc.empty:
         return None
     
-    lon_col = 'lng' if 'lng' in loc.columns else 'lon'
     lat = loc.iloc[0]['lat']
-    lon = loc.iloc[0][lon_col]
+    lon = loc.iloc[0]['lon']
     
     if pd.isna(lat) or pd.isna(lon):
         return None
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-import json
 from dataclasses import asdict
 from typing import Dict, Iterable, List, Sequence, Set, Tuple
 
+import numpy as np
+import orjson
 import pandas as pd
 
 from config import PipelineConfig, RecommendationWeights
@@ -30,35 +31,85 @@ def _taste_contributions(user_tags: pd.DataFrame, location_tags: pd.DataFrame) -
     if user_tags.empty or location_tags.empty:
         empty = pd.DataFrame(columns=["user_id", "location_id", "taste_score"])
         return empty, {}
-    merged = user_tags.merge(
-        location_tags[["location_id", "tag_id", "tag_text", "score"]],
-        on="tag_id",
-        how="inner",
+    # Join and group on integer codes rather than the uuid/user-id strings; user codes
+    # follow sorted user_id order so the grouped output keeps its original ordering
+    tag_codes, _ = pd.factorize(pd.concat([user_tags["tag_id"], location_tags["tag_id"]], ignore_index=True))
+    user_codes, user_labels = pd.factorize(user_tags["user_id"], sort=True)
+    n_user_rows = len(user_tags)
+    user_side = pd.DataFrame(
+        {
+            "user_code": user_codes,
+            "tag_code": tag_codes[:n_user_rows],
+            "user_tag_score": user_tags["score"].to_numpy(),
+        }
     )
-    merged = merged.rename(
-        columns={
-            "score_x": "user_tag_score",
-            "score_y": "location_tag_score",
-            "tag_text_x": "user_tag_text",
-            "tag_text_y": "location_tag_text",
+    location_side = pd.DataFrame(
+        {
+            "location_id": location_tags["location_id"].to_numpy(),
+            "tag_code": tag_codes[n_user_rows:],
+            "location_tag_text": location_tags["tag_text"].to_numpy(),
+            "location_tag_score": location_tags["score"].to_numpy(),
         }
     )
+    merged = user_side.merge(location_side, on="tag_code", how="inner")
+    merged = merged[merged["user_code"] >= 0]
     merged["component"] = (merged["user_tag_score"] / 100.0) * (merged["location_tag_score"] / 100.0)
     taste_scores = (
-        merged.groupby(["user_id", "location_id"])["component"]
+        merged.groupby(["user_code", "location_id"])["component"]
         .sum()
         .reset_index(name="taste_score")
     )
-    merged = merged.sort_values(by="component", ascending=False)
+    taste_scores.insert(0, "user_id", user_labels.take(taste_scores.pop("user_code").to_numpy()))
+    # Only the three strongest contributions per (user, location) are kept as details
+    top3 = (
+        merged.sort_values(by="component", ascending=False)
+        .groupby(["user_code", "location_id"], sort=False)
+        .head(3)
+    )
     detail_map: Dict[Tuple[str, int], List[Dict[str, float]]] = {}
-    for row in merged.itertuples():
-        key = (row.user_id, int(row.location_id))
-        entry = detail_map.setdefault(key, [])
-        if len(entry) < 3:
-            entry.append({"tag": row.location_tag_text, "score": round(row.component, 3)})
+    for user_id, location_id, tag_text, component in zip(
+        user_labels.take(top3["user_code"].to_numpy()).tolist(),
+        top3["location_id"].astype(int).tolist(),
+        top3["location_tag_text"].tolist(),
+        top3["component"].tolist(),
+    ):
+        detail_map.setdefault((user_id, location_id), []).append(
+            {"tag": tag_text, "score": round(component, 3)}
+        )
     return taste_scores, detail_map
 
 
+def _reason_json(taste_tags: List[Dict[str, float]], weights_json: bytes, components: Dict[str, float]) -> str:
+    """Serialize a recommendation reason, splicing in the user's pre-encoded weights."""
+    return (
+        b'{"taste_tags":' + orjson.dumps(taste_tags)
+        + b',"weights":' + weights_json
+        + b',"components":' + orjson.dumps(components) + b"}"
+    ).decode("utf-8")
+
+
+def _positions_of(sorted_ids: np.ndarray, id_order: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Row positions for each id, given the sorted ids and their argsort (-1 where unknown)."""
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == ids, id_order[pos], -1)
+
+
+def _top_k_order(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (ties keep candidate order)."""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        # The partition picks arbitrarily among ties at the cut, so keep every
+        # candidate scoring at least the k-th value and let the stable sort decide
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        idx = np.flatnonzero(scores >= kth)
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")][:k]
+
+
 def _candidate_sets(
     taste_scores: pd.DataFrame,
     top_trend_ids: Sequence[int],
@@ -77,17 +128,19 @@ def _candidate_sets(
     return candidates
 
 
-def _user_seen_locations(user_actions: pd.DataFrame, locations: pd.DataFrame) -> Dict[str, Set[int]]:
+def _user_seen_locations(user_actions: pd.DataFrame, locations: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Sorted unique location ids each user has already interacted with."""
     if user_actions.empty:
         return {}
-    place_to_location = locations.set_index("google_place_id")["location_id"].to_dict()
-    actions = user_actions.copy()
-    actions["location_id"] = actions["place_id"].map(place_to_location)
-    actions = actions.dropna(subset=["location_id"])
-    grouped: Dict[str, Set[int]] = {}
-    for row in actions.itertuples():
-        grouped.setdefault(row.user_id, set()).add(int(row.location_id))
-    return grouped
+    place_to_location = dict(zip(locations["google_place_id"].tolist(), locations["location_id"].tolist()))
+    location_ids = user_actions["place_id"].map(place_to_location)
+    known = location_ids.notna().to_numpy()
+    seen_ids = location_ids.to_numpy()[known].astype(np.int64)
+    user_ids = user_actions["user_id"].to_numpy()[known]
+    return {
+        user_id: np.unique(seen_ids[idx])
+        for user_id, idx in pd.Series(seen_ids).groupby(user_ids, sort=False).indices.items()
+    }
 
 
 def build_recommendations(
@@ -100,16 +153,8 @@ def build_recommendations(
 ) -> pd.DataFrame:
     taste_scores, taste_details = _taste_contributions(user_tags, location_tags)
 
-    top_trend_ids = (
-        locations.sort_values(by="popularity_score", ascending=False)
-        .head(250)["location_id"]
-        .tolist()
-    )
-    top_hidden_ids = (
-        locations.sort_values(by="hidden_gem_score", ascending=False)
-        .head(250)["location_id"]
-        .tolist()
-    )
+    top_trend_ids = locations.nlargest(250, "popularity_score")["location_id"].tolist()
+    top_hidden_ids = locations.nlargest(250, "hidden_gem_score")["location_id"].tolist()
 
     user_ids = set(user_tags["user_id"].unique()) | set(user_history["user_id"].unique())
     if not user_actions.empty and "user_id" in user_actions.columns:
@@ -117,69 +162,103 @@ def build_recommendations(
     candidate_map = _candidate_sets(taste_scores, top_trend_ids, top_hidden_ids, sorted(user_ids))
     seen_locations = _user_seen_locations(user_actions, locations)
     hist_lookup = user_history.set_index("user_id")["n_actions"].to_dict()
-    location_metrics = locations.set_index("location_id")[[
-        "name",
-        "vicinity",
-        "cuisine_primary",
-        "popularity_score",
-        "hidden_gem_score",
-        "quality_score",
-        "rating",
-        "user_ratings_total",
-    ]]
 
-    recommendations: List[Dict] = []
+    # Location metrics as arrays; candidates are scored per user with numpy
+    location_ids = locations["location_id"].to_numpy(dtype=np.int64)
+    pop_arr = locations["popularity_score"].to_numpy(dtype=np.float64)
+    hidden_arr = locations["hidden_gem_score"].to_numpy(dtype=np.float64)
+    quality_arr = locations["quality_score"].to_numpy(dtype=np.float64)
+    id_order = np.argsort(location_ids, kind="stable")
+    sorted_ids = location_ids[id_order]
+
+    # Per-user (positions, taste scores), scattered into a reusable dense buffer below
+    taste_pos = _positions_of(sorted_ids, id_order, taste_scores["location_id"].to_numpy(dtype=np.int64))
+    taste_vals = taste_scores["taste_score"].to_numpy(dtype=np.float64)
+    user_taste: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for user_id, idx in taste_scores.groupby("user_id", sort=False).indices.items():
+        idx = idx[taste_pos[idx] >= 0]
+        user_taste[user_id] = (taste_pos[idx], taste_vals[idx])
+    no_taste = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    dense_taste = np.zeros(len(location_ids), dtype=np.float64)
+
+    # Weights depend only on min(history, 5), so every variant is built and encoded up front
+    weight_table = [
+        (weights, orjson.dumps(weights))
+        for weights in (_adaptive_weights(config.recommendation_weights, h) for h in range(6))
+    ]
+
+    # Output columns are collected as per-user array chunks and concatenated once
+    out_users: List[str] = []
+    out_counts: List[int] = []
+    out_location_ids: List[np.ndarray] = []
+    out_ranks: List[np.ndarray] = []
+    out_scores: List[np.ndarray] = []
+    out_taste: List[np.ndarray] = []
+    out_trend: List[np.ndarray] = []
+    out_hidden: List[np.ndarray] = []
+    out_quality: List[np.ndarray] = []
+    reasons: List[str] = []
 
     for user_id, candidate_ids in candidate_map.items():
         history_size = int(hist_lookup.get(user_id, len(candidate_ids) // 4))
-        weights = _adaptive_weights(config.recommendation_weights, history_size)
-        taste_subset = taste_scores[taste_scores["user_id"] == user_id].set_index("location_id")["taste_score"]
-        seen = seen_locations.get(user_id, set())
-        rows = []
-        for loc_id in candidate_ids:
-            if loc_id in seen:
-                continue
-            if loc_id not in location_metrics.index:
-                continue
-            metrics = location_metrics.loc[loc_id]
-            taste_val = float(taste_subset.get(loc_id, 0.0))
-            pop_val = float(metrics["popularity_score"])
-            hidden_val = float(metrics["hidden_gem_score"])
-            quality_val = float(metrics["quality_score"])
-            score = (
-                weights["taste"] * taste_val
-                + weights["trend_app"] * pop_val
-                + weights["hidden_gems"] * hidden_val
-                + weights["quality"] * quality_val
-            )
-            reason = {
-                "taste_tags": taste_details.get((user_id, loc_id), []),
-                "weights": weights,
-                "components": {
-                    "taste": round(taste_val, 4),
-                    "trend": round(pop_val, 4),
-                    "hidden_gem": round(hidden_val, 4),
-                    "quality": round(quality_val, 4),
-                },
+        if history_size >= 0:
+            weights, weights_json = weight_table[min(history_size, 5)]
+        else:
+            weights = _adaptive_weights(config.recommendation_weights, history_size)
+            weights_json = orjson.dumps(weights)
+        w_taste, w_trend, w_hidden, w_quality = (
+            weights["taste"], weights["trend_app"], weights["hidden_gems"], weights["quality"]
+        )
+        cand_ids = np.fromiter(candidate_ids, dtype=np.int64, count=len(candidate_ids))
+        seen = seen_locations.get(user_id)
+        if seen is not None:
+            cand_ids = cand_ids[~np.isin(cand_ids, seen, assume_unique=True)]
+        cand_pos = _positions_of(sorted_ids, id_order, cand_ids)
+        known = cand_pos >= 0
+        cand_ids, cand_pos = cand_ids[known], cand_pos[known]
+        if len(cand_pos) == 0:
+            continue
+
+        t_pos, t_vals = user_taste.get(user_id, no_taste)
+        dense_taste[t_pos] = t_vals
+        taste = dense_taste[cand_pos]
+        dense_taste[t_pos] = 0.0
+        pop = pop_arr[cand_pos]
+        hidden = hidden_arr[cand_pos]
+        quality = quality_arr[cand_pos]
+        scores = w_taste * taste + w_trend * pop + w_hidden * hidden + w_quality * quality
+
+        # Reasons are only built for the rows that survive the top-k cut
+        top = _top_k_order(scores, config.top_k_per_user)
+        if len(top) == 0:
+            continue
+        top_ids = cand_ids[top]
+        top_taste, top_pop, top_hidden, top_quality = taste[top], pop[top], hidden[top], quality[top]
+        for loc_id, taste_val, pop_val, hidden_val, quality_val in zip(
+            top_ids.tolist(),
+            top_taste.tolist(),
+            top_pop.tolist(),
+            top_hidden.tolist(),
+            top_quality.tolist(),
+        ):
+            components = {
+                "taste": round(taste_val, 4),
+                "trend": round(pop_val, 4),
+                "hidden_gem": round(hidden_val, 4),
+                "quality": round(quality_val, 4),
             }
-            rows.append(
-                {
-                    "user_id": user_id,
-                    "location_id": loc_id,
-                    "score": score,
-                    "taste_score": taste_val,
-                    "trend_score": pop_val,
-                    "hidden_gem_score": hidden_val,
-                    "quality_score": quality_val,
-                    "reason": json.dumps(reason, ensure_ascii=False),
-                }
+            reasons.append(
+                _reason_json(taste_details.get((user_id, loc_id), []), weights_json, components)
             )
-        if not rows:
-            continue
-        rows = sorted(rows, key=lambda r: r["score"], reverse=True)
-        for rank, row in enumerate(rows[: config.top_k_per_user], start=1):
-            row["rank"] = rank
-            recommendations.append(row)
+        out_users.append(user_id)
+        out_counts.append(len(top))
+        out_location_ids.append(top_ids)
+        out_ranks.append(np.arange(1, len(top) + 1))
+        out_scores.append(scores[top])
+        out_taste.append(top_taste)
+        out_trend.append(top_pop)
+        out_hidden.append(top_hidden)
+        out_quality.append(top_quality)
 
     columns = [
         "user_id",
@@ -192,4 +271,19 @@ def build_recommendations(
         "quality_score",
         "reason",
     ]
-    return pd.DataFrame(recommendations, columns=columns)
+    if not out_users:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(
+        {
+            "user_id": np.repeat(np.array(out_users, dtype=object), out_counts),
+            "location_id": np.concatenate(out_location_ids),
+            "rank": np.concatenate(out_ranks),
+            "score": np.concatenate(out_scores),
+            "taste_score": np.concatenate(out_taste),
+            "trend_score": np.concatenate(out_trend),
+            "hidden_gem_score": np.concatenate(out_hidden),
+            "quality_score": np.concatenate(out_quality),
+            "reason": reasons,
+        },
+        columns=columns,
+    )
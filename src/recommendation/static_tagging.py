@@ -1,14 +1,24 @@
 from __future__ import annotations
 
-import json
 import math
+from collections import defaultdict
+from itertools import chain
+from functools import lru_cache
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
+
+try:
+    import ahocorasick
+except ImportError:  # optional: falls back to per-keyword substring checks
+    ahocorasick = None
 
 from config import PipelinePaths, ReviewTagConfig
 from analysis.hidden_gems import add_hidden_gem_scores
+from recommendation.csv_reader import read_csv
 from recommendation.tag_taxonomy import get_tags_dataframe
 
 
@@ -44,16 +54,43 @@ REVIEW_TAG_KEYWORDS: Dict[str, Dict[str, Sequence[str]]] = {
     "gluten_free_options": {"keywords": ["gluten free", "gluten-free", "celiac"]},
 }
 
+REVIEW_TAG_ORDER = {tag_text: i for i, tag_text in enumerate(REVIEW_TAG_KEYWORDS)}
+
 HIDDEN_GEM_TAG_THRESHOLD = 0.6
 HIDDEN_GEM_MIN_REVIEWS = 35
 
 
-def _min_max_scale(values: pd.Series) -> pd.Series:
-    v_min = values.min()
-    v_max = values.max()
+# Explicit types for the numeric/id columns; everything else is inferred by Arrow
+LOCATION_COLUMN_TYPES = {
+    "place_id": pa.string(),
+    "lat": pa.float64(),
+    "lon": pa.float64(),
+    "rating": pa.float64(),
+    "user_ratings_total": pa.float64(),
+    "price_level": pa.float64(),
+}
+REVIEW_COLUMN_TYPES = {
+    "place_id": pa.string(),
+    "rating": pa.float64(),
+    "time": pa.int64(),
+    "text": pa.string(),
+}
+
+
+def _min_max_scale(values: np.ndarray) -> np.ndarray:
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.size == 0:
+        return arr
+    # fmin/fmax skip NaNs like Series.min()/max()
+    v_min = np.fmin.reduce(arr)
+    v_max = np.fmax.reduce(arr)
     if math.isclose(v_min, v_max):
-        return pd.Series(np.zeros(len(values)), index=values.index)
-    return (values - v_min) / (v_max - v_min)
+        return np.zeros(arr.shape)
+    return (arr - v_min) / (v_max - v_min)
+
+
+def _json_text(obj) -> str:
+    return orjson.dumps(obj).decode("utf-8")
 
 
 def _safe_json_loads(raw: str | float | int | None) -> List[Dict]:
@@ -66,11 +103,20 @@ def _safe_json_loads(raw: str | float | int | None) -> List[Dict]:
     if isinstance(raw, list):
         return raw
     try:
-        return json.loads(raw)
+        return orjson.loads(raw)
     except Exception:
         return []
 
 
+def _split_types(types_series: pd.Series) -> pd.Series:
+    """Split comma-separated Google types, parsing each distinct string only once."""
+    codes, uniques = pd.factorize(types_series.fillna("").astype(str))
+    parsed = np.empty(len(uniques), dtype=object)
+    parsed[:] = [[t.strip() for t in s.split(",") if t.strip()] for s in uniques]
+    # Rows with the same types string share one (read-only) list
+    return pd.Series(parsed[codes], index=types_series.index)
+
+
 def _hhmm_to_minutes(value: str | None) -> Optional[int]:
     if not value or not isinstance(value, str):
         return None
@@ -82,49 +128,62 @@ def _hhmm_to_minutes(value: str | None) -> Optional[int]:
     return h * 60 + m
 
 
-def _schedule_flags(periods_raw: str | None) -> Dict[str, bool]:
-    periods = _safe_json_loads(periods_raw)
-    if not periods:
-        return {"open_late": False, "open_early": False, "sunday_open": False}
-    open_late = False
-    open_early = False
-    sunday_open = False
-    for p in periods:
-        open_info = p.get("open", {})
-        close_info = p.get("close", {})
-        open_time = _hhmm_to_minutes(open_info.get("time"))
-        close_time = _hhmm_to_minutes(close_info.get("time"))
-        open_day = open_info.get("day")
-        close_day = close_info.get("day")
-        if open_time is not None and open_time <= 8 * 60:
-            open_early = True
-        if close_time is not None:
-            if close_day is not None and open_day is not None and close_day != open_day:
-                open_late = True
-            elif close_time >= 23 * 60:
-                open_late = True
-        if open_day == 0 or close_day == 0:
-            sunday_open = True
-    return {"open_late": open_late, "open_early": open_early, "sunday_open": sunday_open}
-
-
-def _price_bucket(price_level: float | int | None) -> str:
-    if price_level is None or math.isnan(price_level):
-        return "unknown"
-    if price_level <= 1:
-        return "value"
-    if price_level == 2:
-        return "mid"
-    if price_level >= 3:
-        return "premium"
-    return "unknown"
+def _schedule_flags(periods_series: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Open-late / open-early / Sunday flags, parsing each distinct schedule once."""
+    codes, uniques = pd.factorize(periods_series, use_na_sentinel=False)
+    # Flatten every period of every distinct schedule into parallel arrays (-1 = missing)
+    owner: List[int] = []
+    open_times: List[int] = []
+    close_times: List[int] = []
+    open_days: List[int] = []
+    close_days: List[int] = []
+    for i, raw in enumerate(uniques):
+        for p in _safe_json_loads(raw):
+            open_info = p.get("open", {})
+            close_info = p.get("close", {})
+            open_time = _hhmm_to_minutes(open_info.get("time"))
+            close_time = _hhmm_to_minutes(close_info.get("time"))
+            open_day = open_info.get("day")
+            close_day = close_info.get("day")
+            owner.append(i)
+            open_times.append(-1 if open_time is None else open_time)
+            close_times.append(-1 if close_time is None else close_time)
+            open_days.append(-1 if open_day is None else open_day)
+            close_days.append(-1 if close_day is None else close_day)
+
+    n_unique = len(uniques)
+    owner_arr = np.asarray(owner, dtype=np.int64)
+    open_t = np.asarray(open_times, dtype=np.int64)
+    close_t = np.asarray(close_times, dtype=np.int64)
+    open_d = np.asarray(open_days, dtype=np.int64)
+    close_d = np.asarray(close_days, dtype=np.int64)
+
+    early = (open_t >= 0) & (open_t <= 8 * 60)
+    overnight = (open_d >= 0) & (close_d >= 0) & (close_d != open_d)
+    late = (close_t >= 0) & (overnight | (close_t >= 23 * 60))
+    sunday = (open_d == 0) | (close_d == 0)
+
+    def any_per_schedule(mask: np.ndarray) -> np.ndarray:
+        return np.bincount(owner_arr[mask], minlength=n_unique)[codes] > 0
+
+    return any_per_schedule(late), any_per_schedule(early), any_per_schedule(sunday)
+
+
+def _price_bucket(price_level: pd.Series) -> np.ndarray:
+    levels = price_level.to_numpy(dtype=np.float64, na_value=np.nan)
+    # NaN fails every comparison, and levels between the bins stay "unknown"
+    return np.select(
+        [levels <= 1, levels == 2, levels >= 3],
+        ["value", "mid", "premium"],
+        default="unknown",
+    ).astype(object)
 
 
 def load_locations(paths: PipelinePaths) -> pd.DataFrame:
-    details = pd.read_csv(paths.details_csv())
-    base_df = pd.read_csv(paths.base_csv()) if paths.base_csv().exists() else None
+    # Freshly parsed and owned by this function, so columns are added in place
+    df = read_csv(paths.details_csv(), LOCATION_COLUMN_TYPES)
+    base_df = read_csv(paths.base_csv(), LOCATION_COLUMN_TYPES) if paths.base_csv().exists() else None
 
-    df = details.copy()
     df["location_id"] = np.arange(len(df)) + 1
     df["google_place_id"] = df["place_id"]
     df["name"] = df["name"].fillna("")
@@ -148,29 +207,28 @@ def load_locations(paths: PipelinePaths) -> pd.DataFrame:
         df["grid_id"] = np.nan
 
     types_series = df.get("types", pd.Series([""] * len(df)))
-    df["types_list"] = types_series.fillna("").apply(
-        lambda s: [t.strip() for t in str(s).split(",") if t.strip()]
-    )
+    df["types_list"] = _split_types(types_series)
 
-    schedule_flags = df.get("opening_hours_periods", pd.Series([""] * len(df))).apply(
-        _schedule_flags
+    open_late, open_early, sunday_open = _schedule_flags(
+        df.get("opening_hours_periods", pd.Series([""] * len(df)))
     )
-    df["is_open_late"] = schedule_flags.apply(lambda x: x["open_late"])
-    df["is_open_early"] = schedule_flags.apply(lambda x: x["open_early"])
-    df["is_sunday_open"] = schedule_flags.apply(lambda x: x["sunday_open"])
-
-    df["price_bucket"] = df["price_level"].apply(_price_bucket)
-    df["log_reviews"] = np.log1p(df["user_ratings_total"])
-    df["popularity_score"] = _min_max_scale(df["log_reviews"].fillna(0))
-
-    by_group = (
-        df.groupby(["cuisine_primary", "price_bucket"])["log_reviews"]
-        .transform("mean")
-        .fillna(df["log_reviews"].mean())
-    )
-    df["expected_popularity"] = by_group
+    df["is_open_late"] = open_late
+    df["is_open_early"] = open_early
+    df["is_sunday_open"] = sunday_open
+
+    df["price_bucket"] = _price_bucket(df["price_level"])
+    log_reviews = np.log1p(df["user_ratings_total"].to_numpy(dtype=np.float64))
+    df["log_reviews"] = log_reviews
+    df["popularity_score"] = _min_max_scale(np.where(np.isnan(log_reviews), 0.0, log_reviews))
+
+    # Reduce to the small (cuisine, price bucket) mean table, then gather it back per row
+    grouped = df.groupby(["cuisine_primary", "price_bucket"], sort=False)["log_reviews"]
+    group_means = grouped.mean().to_numpy()
+    expected = group_means[grouped.ngroup().to_numpy()]
+    df["expected_popularity"] = np.where(np.isnan(expected), df["log_reviews"].mean(), expected)
     df["residual_popularity"] = df["log_reviews"] - df["expected_popularity"]
-    df["quality_score"] = _min_max_scale(df["rating"].fillna(df["rating"].mean()))
+    rating = df["rating"].to_numpy(dtype=np.float64, na_value=np.nan)
+    df["quality_score"] = _min_max_scale(np.where(np.isnan(rating), df["rating"].mean(), rating))
 
     return add_hidden_gem_scores(df)
 
@@ -179,7 +237,7 @@ def load_reviews(paths: PipelinePaths, place_to_location: Dict[str, int]) -> pd.
     reviews_path = paths.reviews_csv()
     if not reviews_path.exists():
         return pd.DataFrame(columns=["location_id", "language", "author_name", "text"])
-    reviews = pd.read_csv(reviews_path)
+    reviews = read_csv(reviews_path, REVIEW_COLUMN_TYPES)
     reviews["location_id"] = reviews["place_id"].map(place_to_location)
     reviews = reviews.dropna(subset=["location_id"])
     reviews["text"] = reviews["text"].fillna("")
@@ -195,106 +253,137 @@ def _add_tag_record(records: List[Dict], location_id: int, tag_text: str, score:
             "tag_text": tag_text,
             "score": float(score),
             "source": source,
-            "metadata": json.dumps(metadata, ensure_ascii=False),
+            "metadata": _json_text(metadata),
         }
     )
 
 
-def _deterministic_tags(df: pd.DataFrame) -> List[Dict]:
-    records: List[Dict] = []
-    for row in df.itertuples():
-        if row.cuisine_primary and row.cuisine_primary != "unknown":
-            _add_tag_record(
-                records,
-                row.location_id,
-                row.cuisine_primary,
-                92,
-                "cuisine_detected",
-                {"field": "cuisine_primary"},
+def _deterministic_tags(df: pd.DataFrame) -> pd.DataFrame:
+    location_ids = df["location_id"].to_numpy()
+    row_pos = np.arange(len(df))
+    frames: List[pd.DataFrame] = []
+
+    def add_rule(rule: int, positions: np.ndarray, tag_text, score, source: str, metadata) -> None:
+        frames.append(
+            pd.DataFrame(
+                {
+                    "_order": positions * 8 + rule,
+                    "location_id": location_ids[positions],
+                    "tag_text": tag_text,
+                    "score": score,
+                    "source": source,
+                    "metadata": metadata,
+                }
             )
+        )
 
-        for t in row.types_list:
-            if t in CATEGORY_TYPES:
-                tag_text = CATEGORY_TYPES[t]
-                _add_tag_record(
-                    records,
-                    row.location_id,
-                    tag_text,
-                    75,
-                    "google_types",
-                    {"type": t},
-                )
-
-        if row.price_bucket == "value":
-            _add_tag_record(
-                records,
-                row.location_id,
-                "great_value",
-                80,
-                "price_level",
-                {"price_level": row.price_level},
-            )
-        elif row.price_bucket == "premium":
-            _add_tag_record(
-                records,
-                row.location_id,
-                "pricey",
-                80,
-                "price_level",
-                {"price_level": row.price_level},
-            )
+    cuisine = df["cuisine_primary"].to_numpy(dtype=object)
+    cuisine_rows = row_pos[(cuisine != "") & (cuisine != "unknown")]
+    add_rule(
+        0,
+        cuisine_rows,
+        cuisine[cuisine_rows],
+        92.0,
+        "cuisine_detected",
+        _json_text({"field": "cuisine_primary"}),
+    )
 
-        if row.is_open_late:
-            _add_tag_record(
-                records,
-                row.location_id,
-                "open_late",
-                70,
-                "opening_hours",
-                {},
-            )
-        if row.is_open_early:
-            _add_tag_record(
-                records,
-                row.location_id,
-                "open_early",
-                70,
-                "opening_hours",
-                {},
-            )
-        if row.is_sunday_open:
-            _add_tag_record(
-                records,
-                row.location_id,
-                "sunday_open",
-                65,
-                "opening_hours",
-                {},
-            )
-        if (
-            row.hidden_gem_score >= HIDDEN_GEM_TAG_THRESHOLD
-            and row.user_ratings_total >= HIDDEN_GEM_MIN_REVIEWS
-        ):
-            base_score = 70 + 25 * float(row.hidden_gem_score)
-            rating_val = row.rating
-            rating_num = float(rating_val) if rating_val is not None else float("nan")
-            hype_val = getattr(row, "hype_residual", 0.0)
-            hype_num = float(hype_val) if hype_val is not None else 0.0
-            metadata = {
-                "rating": rating_num if not math.isnan(rating_num) else None,
-                "hype_residual": hype_num,
-                "reviews": int(row.user_ratings_total),
-                "source": getattr(row, "hidden_gem_source", "unknown"),
-            }
-            _add_tag_record(
-                records,
-                row.location_id,
-                "hidden_gem",
-                min(100, base_score),
-                "hidden_gem_model",
-                metadata,
-            )
-    return records
+    types_lists = df["types_list"].tolist()
+    type_rows = np.repeat(row_pos, [len(t) for t in types_lists])
+    flat_types = pd.Series(list(chain.from_iterable(types_lists)), dtype=object)
+    is_category = flat_types.isin(CATEGORY_TYPES).to_numpy()
+    category_types = flat_types[is_category]
+    add_rule(
+        1,
+        type_rows[is_category],
+        category_types.map(CATEGORY_TYPES).to_numpy(),
+        75.0,
+        "google_types",
+        category_types.map(
+            {t: _json_text({"type": t}) for t in CATEGORY_TYPES}
+        ).to_numpy(),
+    )
+
+    price_bucket = df["price_bucket"].to_numpy(dtype=object)
+    price_level = df["price_level"].to_numpy(dtype=np.float64, na_value=np.nan)
+    for bucket, tag_text in (("value", "great_value"), ("premium", "pricey")):
+        positions = row_pos[price_bucket == bucket]
+        levels = price_level[positions].tolist()
+        # Only a handful of distinct price levels, so encode each once
+        encoded = {v: _json_text({"price_level": v}) for v in set(levels)}
+        add_rule(2, positions, tag_text, 80.0, "price_level", [encoded[v] for v in levels])
+
+    for rule, column, tag_text, score in (
+        (3, "is_open_late", "open_late", 70.0),
+        (4, "is_open_early", "open_early", 70.0),
+        (5, "is_sunday_open", "sunday_open", 65.0),
+    ):
+        add_rule(rule, row_pos[df[column].to_numpy(dtype=bool)], tag_text, score, "opening_hours", "{}")
+
+    gem_score = df["hidden_gem_score"].to_numpy(dtype=np.float64)
+    gem_mask = (gem_score >= HIDDEN_GEM_TAG_THRESHOLD) & (
+        df["user_ratings_total"].to_numpy(dtype=np.float64) >= HIDDEN_GEM_MIN_REVIEWS
+    )
+    gem_rows = df[gem_mask]
+    gem_metadata = []
+    for row in gem_rows.itertuples():
+        rating_val = row.rating
+        rating_num = float(rating_val) if rating_val is not None else float("nan")
+        hype_val = getattr(row, "hype_residual", 0.0)
+        hype_num = float(hype_val) if hype_val is not None else 0.0
+        metadata = {
+            "rating": rating_num if not math.isnan(rating_num) else None,
+            "hype_residual": hype_num,
+            "reviews": int(row.user_ratings_total),
+            "source": getattr(row, "hidden_gem_source", "unknown"),
+        }
+        gem_metadata.append(_json_text(metadata))
+    add_rule(
+        6,
+        row_pos[gem_mask],
+        "hidden_gem",
+        np.minimum(100.0, 70 + 25 * gem_score[gem_mask]),
+        "hidden_gem_model",
+        gem_metadata,
+    )
+
+    # Restore the per-location rule order of the original row loop
+    tags = pd.concat(frames, ignore_index=True)
+    order = np.argsort(tags["_order"].to_numpy(), kind="stable")
+    return tags.take(order).drop(columns=["_order"]).reset_index(drop=True)
+
+
+@lru_cache(maxsize=None)
+def _review_keyword_matcher():
+    """Function mapping lowercased review text to the review tags it mentions."""
+    if ahocorasick is None:
+        # Plain substring search (no regex backtracking), with the keyword table flattened once
+        tag_keywords = tuple((tag_text, tuple(meta["keywords"])) for tag_text, meta in REVIEW_TAG_KEYWORDS.items())
+
+        def match(text: str) -> List[str]:
+            found = []
+            for tag_text, keywords in tag_keywords:
+                for kw in keywords:
+                    if kw in text:
+                        found.append(tag_text)
+                        break
+            return found
+        return match
+
+    # One automaton over every keyword; a keyword can belong to several tags
+    keyword_tags: Dict[str, List[str]] = defaultdict(list)
+    for tag_text, meta in REVIEW_TAG_KEYWORDS.items():
+        for kw in meta["keywords"]:
+            keyword_tags[kw].append(tag_text)
+    automaton = ahocorasick.Automaton()
+    for kw, tags in keyword_tags.items():
+        automaton.add_word(kw, tuple(tags))
+    automaton.make_automaton()
+
+    def match(text: str) -> List[str]:
+        found = {tag_text for _, tags in automaton.iter(text) for tag_text in tags}
+        return sorted(found, key=REVIEW_TAG_ORDER.__getitem__)
+    return match
 
 
 def _review_tag_records(
@@ -302,34 +391,48 @@ def _review_tag_records(
 ) -> List[Dict]:
     if reviews.empty:
         return []
-    df = reviews.copy()
+    # Read-only over the caller's frame; the lowered text stays a local Series
+    df = reviews
     if config.english_only:
         df = df[df["language"].str.startswith("en")]
-    df["text_norm"] = df["text"].str.lower()
-    grouped: Dict[Tuple[int, str], Dict[str, set]] = {}
-    for row in df.itertuples():
-        text = row.text_norm
-        found_tags = []
-        for tag_text, meta in REVIEW_TAG_KEYWORDS.items():
-            for kw in meta["keywords"]:
-                if kw in text:
-                    found_tags.append(tag_text)
-                    break
-        if not found_tags:
-            continue
-        for tag_text in found_tags:
-            key = (int(row.location_id), tag_text)
-            entry = grouped.setdefault(key, {"authors": set(), "mentions": 0})
-            entry["mentions"] += 1
-            entry["authors"].add(row.author_name or "anon")
+    text_norm = df["text"].str.lower()
+    match_tags = _review_keyword_matcher()
+    # One (location, tag, author code) triple per tag mention
+    author_codes, _ = pd.factorize(
+        pd.Series([name or "anon" for name in df["author_name"].tolist()], dtype=object)
+    )
+    hit_locations: List[int] = []
+    hit_tags: List[str] = []
+    hit_authors: List[int] = []
+    for location_id, author_code, text in zip(
+        df["location_id"].tolist(), author_codes.tolist(), text_norm.tolist()
+    ):
+        for tag_text in match_tags(text):
+            hit_locations.append(int(location_id))
+            hit_tags.append(tag_text)
+            hit_authors.append(author_code)
+    if not hit_locations:
+        return []
+
+    hits = pd.DataFrame({"location_id": hit_locations, "tag_text": hit_tags, "author": hit_authors})
+    stats = (
+        hits.groupby(["location_id", "tag_text"], sort=False)["author"]
+        .agg(mentions="size", unique_authors="nunique")
+        .reset_index()
+    )
+    keep = (stats["unique_authors"] >= config.min_unique_authors) | (
+        stats["mentions"] >= config.min_mentions
+    )
+    stats = stats[keep]
 
     records: List[Dict] = []
-    for (location_id, tag_text), info in grouped.items():
-        mentions = info["mentions"]
-        unique_authors = len(info["authors"])
-        if unique_authors < config.min_unique_authors and mentions < config.min_mentions:
-            continue
-        score = config.score_floor + 15 * math.log1p(unique_authors) + 10 * math.log1p(mentions)
+    for location_id, tag_text, n_mentions, n_authors in zip(
+        stats["location_id"].tolist(),
+        stats["tag_text"].tolist(),
+        stats["mentions"].tolist(),
+        stats["unique_authors"].tolist(),
+    ):
+        score = config.score_floor + 15 * math.log1p(n_authors) + 10 * math.log1p(n_mentions)
         score = min(config.score_cap, score)
         _add_tag_record(
             records,
@@ -337,7 +440,7 @@ def _review_tag_records(
             tag_text,
             score,
             "reviews",
-            {"mentions": mentions, "unique_authors": unique_authors},
+            {"mentions": n_mentions, "unique_authors": n_authors},
         )
     return records
 
@@ -347,13 +450,16 @@ def build_location_tags(
 ) -> pd.DataFrame:
     deterministic = _deterministic_tags(locations)
     review_based = _review_tag_records(reviews, config)
-    records = deterministic + review_based
+    frames = [deterministic]
+    if review_based:
+        frames.append(pd.DataFrame(review_based))
     tags_df = get_tags_dataframe()
-    location_tags = pd.DataFrame(records)
+    location_tags = pd.concat(frames, ignore_index=True)
     if location_tags.empty:
         return pd.DataFrame(
             columns=["location_id", "tag_id", "tag_text", "score", "source", "metadata"]
         )
-    location_tags = location_tags.merge(tags_df[["tag_id", "text"]], left_on="tag_text", right_on="text", how="inner")
-    location_tags = location_tags.drop(columns=["text"])
-    return location_tags
+    # The taxonomy is small, so a dict lookup beats a join; unknown tags are dropped
+    text_to_id = dict(zip(tags_df["text"].tolist(), tags_df["tag_id"].tolist()))
+    location_tags["tag_id"] = location_tags["tag_text"].map(text_to_id)
+    return location_tags.dropna(subset=["tag_id"]).reset_index(drop=True)
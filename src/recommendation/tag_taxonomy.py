@@ -1,24 +1,53 @@
 """Load and organize tags from Supabase by category."""
 
-from typing import Any, Dict, List
+import threading
+from typing import Any, Dict, List, Tuple
 import pandas as pd
 from supabase_client.supabase_service import get_supabase_service
 
 
+_TAG_ROWS: Dict[int, Tuple[Dict[str, Any], ...]] = {}
+_TAG_ROWS_LOCK = threading.Lock()
+
+
+def _fetch_tags(limit: int) -> Tuple[Dict[str, Any], ...]:
+    """Fetch the tag rows from Supabase once per process (see clear_tag_cache)."""
+    tags = _TAG_ROWS.get(limit)
+    if tags is not None:
+        return tags
+    db = get_supabase_service()
+    tags = tuple(db.get_all_tags(limit=limit) or ())
+    # An empty result is usually a failed or not-yet-seeded fetch; retry it next time
+    if tags:
+        with _TAG_ROWS_LOCK:
+            _TAG_ROWS[limit] = tags
+    return tags
+
+
+def clear_tag_cache() -> None:
+    """Drop the cached tag rows so the next lookup re-fetches them from Supabase."""
+    with _TAG_ROWS_LOCK:
+        _TAG_ROWS.clear()
+    # The service keeps its own TTL cache of the listing; clear it too so the
+    # re-fetch is not served stale rows
+    get_supabase_service().invalidate_tags()
+
+
 def get_tags_dataframe(limit: int = 1000) -> pd.DataFrame:
     """
     Fetch all tags from Supabase and return as a DataFrame.
     
+    The rows are cached; each call builds a fresh DataFrame so callers may mutate it.
+    
     Returns:
         DataFrame with columns: tag_id, text, tag_type, prompt_description, Colour
     """
-    db = get_supabase_service()
-    tags = db.get_all_tags(limit=limit)
+    tags = _fetch_tags(limit)
     
     if not tags:
         return pd.DataFrame(columns=["tag_id", "text", "tag_type", "prompt_description", "Colour"])
     
-    return pd.DataFrame(tags)
+    return pd.DataFrame(list(tags))
 
 
 def get_tags_by_category(limit: int = 1000) -> Dict[str, pd.DataFrame]:
@@ -47,10 +76,9 @@ def get_tag_lookup() -> Dict[str, Dict[str, Any]]:
     Returns:
         Dictionary with tag text as key and full tag dict as value
     """
-    db = get_supabase_service()
-    tags = db.get_all_tags(limit=1000)
+    tags = _fetch_tags(1000)
     
-    return {tag["text"]: tag for tag in tags}
+    return {tag["text"]: dict(tag) for tag in tags}
 
 
 def get_tag_id_lookup() -> Dict[str, str]:
@@ -60,7 +88,6 @@ def get_tag_id_lookup() -> Dict[str, str]:
     Returns:
         Dictionary with tag text as key and tag_id (UUID) as value
     """
-    db = get_supabase_service()
-    tags = db.get_all_tags(limit=1000)
+    tags = _fetch_tags(1000)
     
     return {tag["text"]: tag["tag_id"] for tag in tags}
@@ -1,17 +1,19 @@
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass
 from typing import Dict, Iterable, List, Tuple
 
 import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
 
 from config import (
     DEFAULT_ACTION_WEIGHTS,
     PipelinePaths,
     RECENCY_HALFLIFE_DAYS,
 )
+from recommendation.csv_reader import read_csv
 
 
 SYNTHETIC_PROFILES = [
@@ -20,6 +22,21 @@ SYNTHETIC_PROFILES = [
     {"user_id": "demo_group_hang", "tags": ["group_hang", "mexican", "cocktails"]},
 ]
 
+# Action weights indexed by category code; the trailing 0.0 is for unknown actions
+_ACTIONS = list(DEFAULT_ACTION_WEIGHTS)
+_ACTION_WEIGHTS = np.array([DEFAULT_ACTION_WEIGHTS[a] for a in _ACTIONS] + [0.0])
+
+# Ids and timestamps stay strings (timestamps are parsed in _apply_action_weights)
+ACTION_COLUMN_TYPES = {
+    "user_id": pa.string(),
+    "place_id": pa.string(),
+    "action": pa.string(),
+    "created_at": pa.string(),
+}
+
+# Parsed action logs keyed by (path, mtime); an edited file gets a new key
+_ACTIONS_CACHE: Dict[Tuple[str, int], pd.DataFrame] = {}
+
 
 def load_user_actions(paths: PipelinePaths) -> pd.DataFrame:
     candidate_paths = [
@@ -28,8 +45,14 @@ def load_user_actions(paths: PipelinePaths) -> pd.DataFrame:
     ]
     for candidate in candidate_paths:
         if candidate and candidate.exists():
-            df = pd.read_csv(candidate)
-            return df
+            key = (str(candidate), candidate.stat().st_mtime_ns)
+            if key not in _ACTIONS_CACHE:
+                # Drop entries for older versions of this file
+                for stale in [k for k in _ACTIONS_CACHE if k[0] == key[0]]:
+                    del _ACTIONS_CACHE[stale]
+                _ACTIONS_CACHE[key] = read_csv(candidate, ACTION_COLUMN_TYPES)
+            # Callers get their own frame; the cached one stays untouched
+            return _ACTIONS_CACHE[key].copy()
     return pd.DataFrame(columns=["user_id", "place_id", "action", "created_at"])
 
 
@@ -44,36 +67,43 @@ def synthesize_user_actions(
         .mean()
         .reset_index()
     )
-    rows = []
+    # Column chunks per profile, joined into one frame at the end
+    profile_counts, place_chunks, action_chunks, day_chunks = [], [], [], []
     for profile in profiles:
         tags = profile.get("tags", [])
         subset = tag_scores[tag_scores["tag_text"].isin(tags)]
         if subset.empty:
             continue
+        # Best-scoring row per location, in location_id order
         subset = (
-            subset.sort_values(by="score", ascending=False)
-            .groupby("location_id")
-            .first()
-            .reset_index()
+            subset.sort_values(by="score", ascending=False, kind="stable")
+            .drop_duplicates(subset="location_id")
+            .sort_values(by="location_id", kind="stable")
         )
         chosen = subset.head(12)
-        for _, record in chosen.iterrows():
-            loc_id = int(record["location_id"])
-            place_id = place_lookup.get(loc_id)
-            if not place_id:
-                continue
-            action = rng.choice(["save", "like", "detail_view"], p=[0.4, 0.4, 0.2])
-            days_ago = float(rng.integers(0, 90))
-            timestamp = pd.Timestamp.utcnow() - pd.Timedelta(days=days_ago)
-            rows.append(
-                {
-                    "user_id": profile["user_id"],
-                    "place_id": place_id,
-                    "action": action,
-                    "created_at": timestamp.isoformat(),
-                }
-            )
-    return pd.DataFrame(rows)
+        place_ids = chosen["location_id"].astype(int).map(place_lookup)
+        place_ids = place_ids[place_ids.notna() & (place_ids != "")]
+        n = len(place_ids)
+        if n == 0:
+            continue
+        profile_counts.append((profile["user_id"], n))
+        place_chunks.append(place_ids.to_numpy(dtype=object))
+        action_chunks.append(rng.choice(["save", "like", "detail_view"], size=n, p=[0.4, 0.4, 0.2]))
+        day_chunks.append(rng.integers(0, 90, size=n))
+    if not profile_counts:
+        return pd.DataFrame(columns=["user_id", "place_id", "action", "created_at"])
+    timestamps = pd.Timestamp.utcnow() - pd.to_timedelta(np.concatenate(day_chunks), unit="D")
+    return pd.DataFrame(
+        {
+            "user_id": np.repeat(
+                np.array([user_id for user_id, _ in profile_counts], dtype=object),
+                [n for _, n in profile_counts],
+            ),
+            "place_id": np.concatenate(place_chunks),
+            "action": np.concatenate(action_chunks).astype(object),
+            "created_at": timestamps.strftime("%Y-%m-%dT%H:%M:%S.%f+00:00"),
+        }
+    )
 
 
 def ensure_user_actions(
@@ -88,20 +118,36 @@ def ensure_user_actions(
     return user_actions, False
 
 
+def _parse_timestamps(values: pd.Series) -> pd.Series:
+    """Parse timestamps as UTC, taking the fast ISO-8601 path and falling back per value."""
+    timestamps = pd.to_datetime(values, format="ISO8601", errors="coerce", utc=True)
+    retry = timestamps.isna() & values.notna()
+    if retry.any():
+        timestamps[retry] = pd.to_datetime(values[retry], format="mixed", errors="coerce", utc=True)
+    return timestamps
+
+
 def _apply_action_weights(actions: pd.DataFrame) -> pd.DataFrame:
-    df = actions.copy()
-    df["action"] = df["action"].astype(str).str.lower()
-    df["weight"] = df["action"].map(DEFAULT_ACTION_WEIGHTS).fillna(0.0)
-    if "created_at" in df.columns:
-        timestamps = pd.to_datetime(df["created_at"], errors="coerce", utc=True)
-        age_days = (pd.Timestamp.utcnow().tz_convert("UTC") - timestamps).dt.total_seconds() / 86400.0
-        age_days = age_days.fillna(0.0).clip(lower=0.0)
-        decay = np.exp(-age_days / RECENCY_HALFLIFE_DAYS)
-    else:
-        decay = 1.0
-    df["weight"] = df["weight"].astype(float) * decay
-    df = df[df["weight"] != 0]
-    return df
+    action = actions["action"].astype(str).str.lower()
+    codes = pd.Categorical(action, categories=_ACTIONS).codes
+    weight = _ACTION_WEIGHTS[np.where(codes < 0, len(_ACTIONS), codes)]
+    # Drop zero-weight actions before parsing any timestamps
+    keep = weight != 0
+    if not keep.any():
+        return actions.iloc[:0].assign(action=action.iloc[:0], weight=weight[:0])
+    if not keep.all():
+        actions, action, weight = actions[keep], action[keep], weight[keep]
+    if "created_at" in actions.columns:
+        now = pd.Timestamp.utcnow().tz_convert("UTC")
+        timestamps = _parse_timestamps(actions["created_at"])
+        # Unparseable timestamps count as "now" (no decay)
+        age_days = (now - timestamps.fillna(now)).dt.total_seconds().to_numpy() / 86400.0
+        weight = weight * np.exp(-np.maximum(age_days, 0.0) / RECENCY_HALFLIFE_DAYS)
+        # Very old actions can decay all the way to zero
+        keep = weight != 0
+        if not keep.all():
+            actions, action, weight = actions[keep], action[keep], weight[keep]
+    return actions.assign(action=action, weight=weight)
 
 
 def build_user_tag_affinities(
@@ -115,11 +161,17 @@ def build_user_tag_affinities(
             pd.DataFrame(columns=["user_id", "n_actions"]),
         )
 
-    place_to_location = locations.set_index("google_place_id")["location_id"].to_dict()
-    df_actions = user_actions.copy()
-    df_actions["location_id"] = df_actions["place_id"].map(place_to_location)
-    df_actions = df_actions.dropna(subset=["location_id"])
-    df_actions["location_id"] = df_actions["location_id"].astype(int)
+    # Hash join onto location ids; a repeated place id resolves to its last row, as a dict would
+    place_locations = (
+        locations[["google_place_id", "location_id"]]
+        .dropna()
+        .drop_duplicates(subset="google_place_id", keep="last")
+        .rename(columns={"google_place_id": "place_id"})
+        .astype({"location_id": int})
+    )
+    df_actions = user_actions.drop(columns="location_id", errors="ignore").merge(
+        place_locations, on="place_id", how="inner"
+    )
     df_actions = _apply_action_weights(df_actions)
     if df_actions.empty:
         return (
@@ -127,7 +179,7 @@ def build_user_tag_affinities(
             pd.DataFrame(columns=["user_id", "n_actions"]),
         )
 
-    merged = df_actions.merge(
+    merged = df_actions[["user_id", "location_id", "weight"]].merge(
         location_tags[["location_id", "tag_id", "tag_text", "score"]],
         on="location_id",
         how="inner",
@@ -139,33 +191,34 @@ def build_user_tag_affinities(
         )
 
     merged["contrib"] = merged["weight"] * (merged["score"] / 100.0)
+    # Group on category codes instead of hashing the string keys row by row;
+    # sorted categories keep the usual sorted group order
+    key_cols = ["user_id", "tag_id", "tag_text"]
+    key_dtypes = merged[key_cols].dtypes
+    keys = [merged[col].astype("category") for col in key_cols]
     agg = (
-        merged.groupby(["user_id", "tag_id", "tag_text"])["contrib"]
+        merged["contrib"].groupby(keys, observed=True)
         .sum()
         .reset_index()
+        .astype(key_dtypes.to_dict())
     )
+    # Scale each user's contributions to 0-100 (users with no positive signal score 0)
+    max_per_user = agg.groupby("user_id")["contrib"].transform("max")
+    agg["score"] = (agg["contrib"] / max_per_user.where(max_per_user > 0) * 100.0).fillna(0.0)
+
+    # Keep each user's top 25 before sorting, so only the survivors are ordered
+    # ("first" breaks ties in row order, like a stable sort followed by head)
+    rank = agg.groupby("user_id")["score"].rank(method="first", ascending=False)
+    normalized = agg[rank <= 25].sort_values(by=["user_id", "score"], ascending=[True, False])
+    normalized["metadata"] = [
+        orjson.dumps({"raw_score": raw_score}).decode()
+        for raw_score in normalized["contrib"].fillna(0.0).tolist()
+    ]
+    normalized = normalized.drop(columns=["contrib"]).reset_index(drop=True)
 
-    def _normalize(group: pd.DataFrame) -> pd.DataFrame:
-        max_val = group["contrib"].max()
-        if max_val <= 0:
-            group["score"] = 0.0
-        else:
-            group["score"] = (group["contrib"] / max_val) * 100.0
-        return group
-
-    normalized = agg.groupby("user_id", group_keys=False).apply(_normalize)
-    normalized = normalized.sort_values(by=["user_id", "score"], ascending=[True, False])
-    normalized["metadata"] = normalized["contrib"].apply(
-        lambda val: json.dumps({"raw_score": val}, ensure_ascii=False)
-    )
-    normalized = normalized.drop(columns=["contrib"])
-    normalized = normalized.groupby("user_id").head(25).reset_index(drop=True)
-
-    user_history = (
-        df_actions.groupby("user_id")
-        .size()
-        .reset_index(name="n_actions")
-        .sort_values(by="n_actions", ascending=False)
-    )
+    user_codes, user_ids = pd.factorize(df_actions["user_id"], sort=True)
+    user_history = pd.DataFrame(
+        {"user_id": user_ids, "n_actions": np.bincount(user_codes[user_codes >= 0], minlength=len(user_ids))}
+    ).sort_values(by="n_actions", ascending=False, kind="stable")
 
     return normalized, user_history
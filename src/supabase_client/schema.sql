@@ -95,6 +95,8 @@ CREATE TABLE public.locations (
   derived_attributes jsonb,
   data_version text NOT NULL DEFAULT 'v1'::text,
   ingested_at timestamp with time zone NOT NULL DEFAULT now(),
+  photo_classification_status text,
+  photo_classification_attempts smallint NOT NULL DEFAULT 0,
   CONSTRAINT locations_pkey PRIMARY KEY (location_id)
 );
 CREATE TABLE public.recommendation_candidates (
@@ -110,6 +112,7 @@ CREATE TABLE public.recommendation_candidates (
   CONSTRAINT recommendation_candidates_run_id_fkey FOREIGN KEY (run_id) REFERENCES public.recommendation_runs(run_id),
   CONSTRAINT recommendation_candidates_location_id_fkey FOREIGN KEY (location_id) REFERENCES public.locations(location_id)
 );
+CREATE INDEX recommendation_candidates_run_id_score_idx ON public.recommendation_candidates (run_id, score DESC);
 CREATE TABLE public.recommendation_runs (
   run_id uuid NOT NULL DEFAULT gen_random_uuid(),
   user_id uuid,
@@ -1,10 +1,76 @@
+import copy
 import os
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from typing import Optional, List, Dict, Any, Iterable, Tuple
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
-# Load environment variables
-load_dotenv()
+# Ids per `in` filter; the ids travel in the request URL, so keep it bounded
+BULK_CHUNK_SIZE = 200
+# Rows per bulk insert/upsert request body
+WRITE_CHUNK_SIZE = 1000
+
+
+# Tags and locations change rarely; cached reads are served for this long
+CACHE_TTL_SECONDS = 300.0
+CACHE_MAX_ENTRIES = 10_000
+
+# Default projections for the list reads; these leave out the jsonb payloads
+# (metadata, reason, features, evidence). Pass columns="*" for full rows.
+LOCATION_TAG_COLUMNS = "id,location_id,tag_id,score"
+RECOMMENDATION_CANDIDATE_COLUMNS = "candidate_id,run_id,location_id,score,rank"
+USER_TAG_AFFINITY_COLUMNS = "user_id,tag_id,affinity"
+
+# Primary key columns of each table; the single-row CRUD helpers filter on these
+TABLE_KEYS: Dict[str, Tuple[str, ...]] = {
+    "tags": ("tag_id",),
+    "locations": ("location_id",),
+    "location_tags": ("id",),
+    "recommendation_candidates": ("candidate_id",),
+    "user_tag_affinities": ("user_id", "tag_id"),
+}
+
+
+class _TTLCache:
+    """Small thread-safe key -> value cache whose entries expire after a fixed TTL"""
+    
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, maxsize: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: Dict[Any, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+        # Callers get their own copy so cached rows cannot be mutated in place
+        return copy.deepcopy(entry[1])
+    
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            if len(self._entries) >= self.maxsize and key not in self._entries:
+                # Drop the entry closest to expiry (the oldest insert)
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+    
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _chunks(values: List[Any], size: int = BULK_CHUNK_SIZE) -> Iterable[List[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
 
 
 class SupabaseService:
@@ -19,6 +85,9 @@ class SupabaseService:
             raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in environment")
         
         self.client: Client = create_client(url, key)
+        self._tag_cache = _TTLCache()
+        self._all_tags_cache = _TTLCache()  # keyed by limit
+        self._location_cache = _TTLCache()
     
     # ==================== TAGS CRUD ====================
     
@@ -33,41 +102,71 @@ class SupabaseService:
         if colour:
             data["Colour"] = colour
             
-        response = self.client.table("tags").insert(data).execute()
-        return response.data[0] if response.data else None
+        row = self._insert_row("tags", data)
+        self._all_tags_cache.clear()
+        return row
     
     def get_tag(self, tag_id: str) -> Optional[Dict[str, Any]]:
-        """Get a tag by ID"""
-        response = self.client.table("tags").select("*").eq("tag_id", tag_id).execute()
-        return response.data[0] if response.data else None
+        """Get a tag by ID (cached for CACHE_TTL_SECONDS)"""
+        cached = self._tag_cache.get(tag_id)
+        if cached is not None:
+            return cached
+        row = self._get_row("tags", tag_id)
+        if row is not None:
+            self._tag_cache.set(tag_id, row)
+        return row
+    
+    def get_tags_bulk(self, tag_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Get many tags in as few requests as possible, keyed by tag_id"""
+        return self._get_bulk("tags", "tag_id", tag_ids)
     
     def get_all_tags(self, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get all tags"""
+        """Get all tags (cached for CACHE_TTL_SECONDS unless empty)"""
+        cached = self._all_tags_cache.get(limit)
+        if cached is not None:
+            return cached
         response = self.client.table("tags").select("*").limit(limit).execute()
+        if response.data:
+            self._all_tags_cache.set(limit, response.data)
         return response.data
     
     def update_tag(self, tag_id: str, **kwargs) -> Optional[Dict[str, Any]]:
         """Update a tag"""
-        response = self.client.table("tags").update(kwargs).eq("tag_id", tag_id).execute()
-        return response.data[0] if response.data else None
+        row = self._update_row("tags", kwargs, tag_id)
+        self._invalidate_tag(tag_id)
+        return row
     
     def delete_tag(self, tag_id: str) -> bool:
         """Delete a tag"""
-        response = self.client.table("tags").delete().eq("tag_id", tag_id).execute()
-        return len(response.data) > 0
+        deleted = self._delete_row("tags", tag_id)
+        self._invalidate_tag(tag_id)
+        return deleted
+    
+    def invalidate_tags(self) -> None:
+        """Drop every cached tag and tag listing so the next reads hit Supabase"""
+        self._tag_cache.clear()
+        self._all_tags_cache.clear()
     
     # ==================== LOCATIONS CRUD ====================
     
     def create_location(self, name: str, **kwargs) -> Dict[str, Any]:
         """Create a new location"""
         data = {"name": name, **kwargs}
-        response = self.client.table("locations").insert(data).execute()
-        return response.data[0] if response.data else None
+        return self._insert_row("locations", data)
     
     def get_location(self, location_id: int) -> Optional[Dict[str, Any]]:
-        """Get a location by ID"""
-        response = self.client.table("locations").select("*").eq("location_id", location_id).execute()
-        return response.data[0] if response.data else None
+        """Get a location by ID (cached for CACHE_TTL_SECONDS)"""
+        cached = self._location_cache.get(location_id)
+        if cached is not None:
+            return cached
+        row = self._get_row("locations", location_id)
+        if row is not None:
+            self._location_cache.set(location_id, row)
+        return row
+    
+    def get_locations_bulk(self, location_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Get many locations in as few requests as possible, keyed by location_id"""
+        return self._get_bulk("locations", "location_id", location_ids)
     
     def get_locations(self, limit: int = 100, offset: int = 0, **filters) -> List[Dict[str, Any]]:
         """Get locations with optional filters"""
@@ -79,13 +178,15 @@ class SupabaseService:
     
     def update_location(self, location_id: int, **kwargs) -> Optional[Dict[str, Any]]:
         """Update a location"""
-        response = self.client.table("locations").update(kwargs).eq("location_id", location_id).execute()
-        return response.data[0] if response.data else None
+        row = self._update_row("locations", kwargs, location_id)
+        self._location_cache.pop(location_id)
+        return row
     
     def delete_location(self, location_id: int) -> bool:
         """Delete a location"""
-        response = self.client.table("locations").delete().eq("location_id", location_id).execute()
-        return len(response.data) > 0
+        deleted = self._delete_row("locations", location_id)
+        self._location_cache.pop(location_id)
+        return deleted
     
     # ==================== LOCATION_TAGS CRUD ====================
     
@@ -103,18 +204,21 @@ class SupabaseService:
         if metadata:
             data["metadata"] = metadata
             
-        response = self.client.table("location_tags").insert(data).execute()
-        return response.data[0] if response.data else None
+        return self._insert_row("location_tags", data)
+    
+    def create_location_tags_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create many location-tag associations, one request per WRITE_CHUNK_SIZE rows"""
+        return self._write_bulk("location_tags", rows)
     
     def get_location_tag(self, location_tag_id: int) -> Optional[Dict[str, Any]]:
         """Get a location_tag by ID"""
-        response = self.client.table("location_tags").select("*").eq("id", location_tag_id).execute()
-        return response.data[0] if response.data else None
+        return self._get_row("location_tags", location_tag_id)
     
     def get_location_tags(self, location_id: Optional[int] = None, 
-                         tag_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                         tag_id: Optional[str] = None,
+                         columns: str = LOCATION_TAG_COLUMNS) -> List[Dict[str, Any]]:
         """Get location tags, optionally filtered by location_id or tag_id"""
-        query = self.client.table("location_tags").select("*")
+        query = self.client.table("location_tags").select(columns)
         if location_id:
             query = query.eq("location_id", location_id)
         if tag_id:
@@ -124,13 +228,11 @@ class SupabaseService:
     
     def update_location_tag(self, location_tag_id: int, **kwargs) -> Optional[Dict[str, Any]]:
         """Update a location_tag"""
-        response = self.client.table("location_tags").update(kwargs).eq("id", location_tag_id).execute()
-        return response.data[0] if response.data else None
+        return self._update_row("location_tags", kwargs, location_tag_id)
     
     def delete_location_tag(self, location_tag_id: int) -> bool:
         """Delete a location_tag"""
-        response = self.client.table("location_tags").delete().eq("id", location_tag_id).execute()
-        return len(response.data) > 0
+        return self._delete_row("location_tags", location_tag_id)
     
     # ==================== RECOMMENDATION_CANDIDATES CRUD ====================
     
@@ -150,35 +252,41 @@ class SupabaseService:
         if features:
             data["features"] = features
             
-        response = self.client.table("recommendation_candidates").insert(data).execute()
-        return response.data[0] if response.data else None
+        return self._insert_row("recommendation_candidates", data)
+    
+    def create_recommendation_candidates_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create many recommendation candidates, one request per WRITE_CHUNK_SIZE rows"""
+        return self._write_bulk("recommendation_candidates", rows)
     
     def get_recommendation_candidate(self, candidate_id: str) -> Optional[Dict[str, Any]]:
         """Get a recommendation candidate by ID"""
-        response = self.client.table("recommendation_candidates").select("*").eq("candidate_id", candidate_id).execute()
-        return response.data[0] if response.data else None
+        return self._get_row("recommendation_candidates", candidate_id)
     
     def get_recommendation_candidates(self, run_id: Optional[str] = None,
                                      location_id: Optional[int] = None,
-                                     limit: int = 100) -> List[Dict[str, Any]]:
-        """Get recommendation candidates, optionally filtered"""
-        query = self.client.table("recommendation_candidates").select("*").limit(limit)
+                                     limit: int = 100,
+                                     columns: str = RECOMMENDATION_CANDIDATE_COLUMNS,
+                                     order_by: str = "score",
+                                     descending: bool = True,
+                                     offset: int = 0) -> List[Dict[str, Any]]:
+        """Get a page of recommendation candidates, best score first by default"""
+        query = self.client.table("recommendation_candidates").select(columns)
         if run_id:
             query = query.eq("run_id", run_id)
         if location_id:
             query = query.eq("location_id", location_id)
+        # Sort and page on the server so only the requested rows are returned
+        query = query.order(order_by, desc=descending).range(offset, offset + limit - 1)
         response = query.execute()
         return response.data
     
     def update_recommendation_candidate(self, candidate_id: str, **kwargs) -> Optional[Dict[str, Any]]:
         """Update a recommendation candidate"""
-        response = self.client.table("recommendation_candidates").update(kwargs).eq("candidate_id", candidate_id).execute()
-        return response.data[0] if response.data else None
+        return self._update_row("recommendation_candidates", kwargs, candidate_id)
     
     def delete_recommendation_candidate(self, candidate_id: str) -> bool:
         """Delete a recommendation candidate"""
-        response = self.client.table("recommendation_candidates").delete().eq("candidate_id", candidate_id).execute()
-        return len(response.data) > 0
+        return self._delete_row("recommendation_candidates", candidate_id)
     
     # ==================== USER_TAG_AFFINITIES CRUD ====================
     
@@ -193,23 +301,47 @@ class SupabaseService:
         if evidence:
             data["evidence"] = evidence
             
-        response = self.client.table("user_tag_affinities").upsert(data).execute()
-        return response.data[0] if response.data else None
+        return self._insert_row("user_tag_affinities", data, upsert=True)
+    
+    def upsert_user_tag_affinities_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Upsert many user tag affinities, one request per WRITE_CHUNK_SIZE rows"""
+        return self._write_bulk("user_tag_affinities", rows, on_conflict="user_id,tag_id")
     
     def get_user_tag_affinity(self, user_id: str, tag_id: str) -> Optional[Dict[str, Any]]:
         """Get a user tag affinity"""
-        response = (self.client.table("user_tag_affinities")
-                   .select("*")
-                   .eq("user_id", user_id)
-                   .eq("tag_id", tag_id)
-                   .execute())
-        return response.data[0] if response.data else None
+        return self._get_row("user_tag_affinities", user_id, tag_id)
+    
+    def get_user_tag_affinities_bulk(
+        self, pairs: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Get many user tag affinities, keyed by (user_id, tag_id)"""
+        wanted = set(pairs)
+        if not wanted:
+            return {}
+        user_ids = sorted({user_id for user_id, _ in wanted})
+        tag_ids = sorted({tag_id for _, tag_id in wanted})
+        
+        # Filter on both columns server-side, then keep only the requested pairs
+        results = {}
+        for user_chunk in _chunks(user_ids):
+            for tag_chunk in _chunks(tag_ids):
+                response = (self.client.table("user_tag_affinities")
+                           .select("*")
+                           .in_("user_id", user_chunk)
+                           .in_("tag_id", tag_chunk)
+                           .execute())
+                for row in response.data:
+                    key = (row["user_id"], row["tag_id"])
+                    if key in wanted:
+                        results[key] = row
+        return results
     
     def get_user_tag_affinities(self, user_id: Optional[str] = None,
                                tag_id: Optional[str] = None,
-                               min_affinity: Optional[float] = None) -> List[Dict[str, Any]]:
+                               min_affinity: Optional[float] = None,
+                               columns: str = USER_TAG_AFFINITY_COLUMNS) -> List[Dict[str, Any]]:
         """Get user tag affinities with optional filters"""
-        query = self.client.table("user_tag_affinities").select("*")
+        query = self.client.table("user_tag_affinities").select(columns)
         if user_id:
             query = query.eq("user_id", user_id)
         if tag_id:
@@ -221,30 +353,86 @@ class SupabaseService:
     
     def update_user_tag_affinity(self, user_id: str, tag_id: str, **kwargs) -> Optional[Dict[str, Any]]:
         """Update a user tag affinity"""
-        response = (self.client.table("user_tag_affinities")
-                   .update(kwargs)
-                   .eq("user_id", user_id)
-                   .eq("tag_id", tag_id)
-                   .execute())
-        return response.data[0] if response.data else None
+        return self._update_row("user_tag_affinities", kwargs, user_id, tag_id)
     
     def delete_user_tag_affinity(self, user_id: str, tag_id: str) -> bool:
         """Delete a user tag affinity"""
-        response = (self.client.table("user_tag_affinities")
-                   .delete()
-                   .eq("user_id", user_id)
-                   .eq("tag_id", tag_id)
-                   .execute())
+        return self._delete_row("user_tag_affinities", user_id, tag_id)
+    
+    # ==================== HELPERS ====================
+    
+    def _match_key(self, query, table: str, key: Tuple[Any, ...]):
+        """Filter a query down to the row whose primary key is `key`"""
+        for column, value in zip(TABLE_KEYS[table], key):
+            query = query.eq(column, value)
+        return query
+    
+    def _insert_row(self, table: str, data: Dict[str, Any],
+                    upsert: bool = False) -> Optional[Dict[str, Any]]:
+        """Insert (or upsert) one row and return it as written"""
+        query = self.client.table(table)
+        response = (query.upsert(data) if upsert else query.insert(data)).execute()
+        return response.data[0] if response.data else None
+    
+    def _get_row(self, table: str, *key: Any) -> Optional[Dict[str, Any]]:
+        """Get one row by primary key"""
+        query = self._match_key(self.client.table(table).select("*"), table, key)
+        response = query.execute()
+        return response.data[0] if response.data else None
+    
+    def _update_row(self, table: str, data: Dict[str, Any], *key: Any) -> Optional[Dict[str, Any]]:
+        """Update one row by primary key and return it as written"""
+        query = self._match_key(self.client.table(table).update(data), table, key)
+        response = query.execute()
+        return response.data[0] if response.data else None
+    
+    def _delete_row(self, table: str, *key: Any) -> bool:
+        """Delete one row by primary key, returning whether it existed"""
+        query = self._match_key(self.client.table(table).delete(), table, key)
+        response = query.execute()
         return len(response.data) > 0
+    
+    def _invalidate_tag(self, tag_id: str) -> None:
+        """Drop a tag from the per-id cache and every cached tag listing"""
+        self._tag_cache.pop(tag_id)
+        self._all_tags_cache.clear()
+    
+    def _write_bulk(self, table: str, rows: List[Dict[str, Any]],
+                    on_conflict: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Insert (or upsert on `on_conflict`) rows in chunks, returning the written rows"""
+        written = []
+        for chunk in _chunks(list(rows), WRITE_CHUNK_SIZE):
+            if on_conflict:
+                query = self.client.table(table).upsert(chunk, on_conflict=on_conflict)
+            else:
+                query = self.client.table(table).insert(chunk)
+            written.extend(query.execute().data)
+        return written
+    
+    def _get_bulk(self, table: str, key: str, ids: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+        """Fetch rows whose `key` is in `ids` with one `in` query per chunk"""
+        unique_ids = list(dict.fromkeys(ids))
+        results = {}
+        for chunk in _chunks(unique_ids):
+            response = self.client.table(table).select("*").in_(key, chunk).execute()
+            for row in response.data:
+                results[row[key]] = row
+        return results
 
 
 # Singleton instance
 _supabase_service = None
+_supabase_service_lock = threading.Lock()
 
 
 def get_supabase_service() -> SupabaseService:
     """Get or create the singleton SupabaseService instance"""
     global _supabase_service
     if _supabase_service is None:
-        _supabase_service = SupabaseService()
+        # Threadpool workers may race here on the first request; only one of
+        # them should read .env and open the client
+        with _supabase_service_lock:
+            if _supabase_service is None:
+                load_dotenv()
+                _supabase_service = SupabaseService()
     return _supabase_service
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 """
 Startup script for the Proximal Recommendations API.
+
+Runs in production mode by default: no auto-reload and a single worker process.
+Each worker keeps its own full copy of the data in memory, so APP_WORKERS opts
+in to more of them. Set APP_RELOAD=1 for an auto-reloading development server.
 """
 
+import os
 import sys
 import uvicorn
 from pathlib import Path
@@ -12,7 +17,12 @@ src_path = Path(__file__).parent / "src"
 sys.path.insert(0, str(src_path))
 
 if __name__ == "__main__":
+    reload = os.getenv("APP_RELOAD", "0") == "1"
+    # The file watcher only supports a single process
+    workers = 1 if reload else int(os.getenv("APP_WORKERS", "1"))
+    
     print("Starting Pinit Proximal Recommendations API...")
+    print(f"Mode: {'development (auto-reload)' if reload else f'production ({workers} workers)'}")
     print("API Documentation: http://localhost:8000/docs")
     print("Health Check: http://localhost:8000/health")
     print("\nPress CTRL+C to stop\n")
@@ -21,6 +31,7 @@ if __name__ == "__main__":
         "api.proximal_api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=reload,
+        workers=workers,
         log_level="info"
     )